@@ -0,0 +1,287 @@
+"""Benchmark ponta a ponta: roteador, emissor e receptor no mesmo processo, em loopback.
+
+Cada execução sobe um UDPRouter com as perturbações do cenário, um receptor.Receptor e um
+GoBackNSender com --conexoes transferências de --tamanho bytes aleatórios (lidos por mmap,
+como no emissor com --arquivo). Mede goodput, razão de retransmissão, tempo de conclusão e
+CPU por MB entregue (total e por componente) e confere o CRC32 do que chegou.
+
+Os parâmetros de cenário aceitam listas separadas por vírgula e formam uma grade; cada
+combinação roda --repeticoes vezes com sementes diferentes. --json/--csv gravam uma linha
+por execução; --base compara as medianas com um JSON anterior e sai com erro se goodput ou
+CPU/MB piorarem além de --tolerancia.
+
+    python benchmark.py --drop 0,0.02 --janela 8,64 --payload 1024,8192 --json base.json
+    python benchmark.py --drop 0,0.02 --janela 8,64 --payload 1024,8192 --base base.json
+
+Os três componentes dividem um GIL (e as CPUs da máquina): os números servem para comparar
+versões do código na mesma máquina, não para estimar um enlace real.
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import emissor
+import receptor
+from emissor import CONTROLADORES, MAX_PAYLOAD, GoBackNSender, JanelaFixa, abrir_fonte, executar_todas
+from protocolo import JANELA_SERIAL_MAX
+from roteador import UDPRouter
+
+LOCAL = "127.0.0.1"
+BUFFER_SOCKET = 4 << 20 #SO_RCVBUF/SO_SNDBUF: perdas só as do roteador, não as do kernel
+
+# parâmetro -> (tipo, padrão, ajuda); cada um aceita uma lista separada por vírgula
+GRADE = {
+    "drop": (float, "0", "Perda emissor->receptor (p_drop_fwd)"),
+    "corrupt": (float, "0", "Corrupcao emissor->receptor (p_corrupt_fwd)"),
+    "reorder": (float, "0", "Reordenacao emissor->receptor (p_reorder_fwd)"),
+    "dup": (float, "0", "Duplicacao emissor->receptor (p_dup_fwd)"),
+    "atraso": (float, "0", "Atraso medio emissor->receptor em s (delay_mean_fwd)"),
+    "drop_ack": (float, "0", "Perda de ACKs (p_drop_back)"),
+    "atraso_ack": (float, "0", "Atraso medio dos ACKs em s (delay_mean_back)"),
+    "janela": (int, "32", "Janela fixa; com --controle reno/atraso, o teto da janela"),
+    "payload": (int, "1024", "Bytes de dados por pacote"),
+    "modo": (str, "gbn", "gbn ou sr"),
+    "controle": (str, "fixa", "Controle de janela: " + ", ".join(sorted(CONTROLADORES))),
+    "checksum": (str, "internet", "internet ou crc32 (negociado com o receptor)"),
+    "conexoes": (int, "1", "Transferencias simultaneas pelo mesmo socket (ids 1..N)"),
+}
+METRICAS = ("tempo_s", "goodput_mb_s", "razao_retransmissao", "cpu_ms_por_mb")
+# sentido bom de cada métrica comparada com --base: +1 = maior é melhor
+SENTIDO = {"goodput_mb_s": 1, "cpu_ms_por_mb": -1}
+
+
+def cenarios(grade):
+    """Produto cartesiano da grade: um dict por combinação, na ordem de GRADE."""
+    nomes = list(grade)
+    for valores in itertools.product(*(grade[n] for n in nomes)):
+        yield dict(zip(nomes, valores))
+
+
+def chave(resultado):
+    """Identifica o cenário de uma linha de resultado (para juntar repetições e comparar com a base)."""
+    return tuple((n, resultado[n]) for n in (*GRADE, "tamanho", "motor"))
+
+
+def _cronometrar(cpu, nome, fn, *args):
+    # CPU da própria thread; vale por componente quando ele roda numa thread só
+    t0 = time.thread_time()
+    try:
+        fn(*args)
+    finally:
+        cpu[nome] = time.thread_time() - t0
+
+
+def _buffers(*socks):
+    for s in socks:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SOCKET)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SOCKET)
+
+
+def medir(cenario, caminho, crc_esperado, tamanho, semente, motor="selectors", lote=8,
+          janela_reordenacao=3, tempo_max=60.0):
+    """Uma execução do cenário; devolve a linha de resultado (dict)."""
+    c = cenario
+    rx = receptor.Receptor((LOCAL, 0), None, guardar=False, espera_fin=None, anunciar=False)
+    tx = GoBackNSender((LOCAL, 0), None)
+    roteador = UDPRouter(LOCAL, 0, *tx.local, *rx.local,
+                         p_corrupt_fwd=c["corrupt"], p_drop_fwd=c["drop"], p_dup_fwd=c["dup"],
+                         p_reorder_fwd=c["reorder"], delay_mean_fwd=c["atraso"], scramble_mode_fwd="bitflip",
+                         p_drop_back=c["drop_ack"], p_dup_back=0.0, delay_mean_back=c["atraso_ack"],
+                         reorder_window=janela_reordenacao, seed=semente, ack_port=0)
+    tx.destino = roteador.sock_fwd.getsockname()
+    rx.destino = (LOCAL, roteador.sock_back.getsockname()[1])
+    _buffers(rx.sock, tx.sock, roteador.sock_fwd, roteador.sock_back)
+
+    def controle():
+        if c["controle"] == "fixa":
+            return JanelaFixa(c["janela"], c["janela"])
+        return CONTROLADORES[c["controle"]](maxima=c["janela"])
+
+    transferencias = [
+        tx.abrir(abrir_fonte(caminho), conn=i + 1 if c["conexoes"] > 1 else None, controle=controle(),
+                 payload=c["payload"], modo_sr=c["modo"] == "sr", pedir_crc32=c["checksum"] == "crc32")
+        for i in range(c["conexoes"])]
+
+    cpu = {}
+    threads = [threading.Thread(target=_cronometrar, args=(cpu, "roteador", roteador.run, motor, lote), daemon=True),
+               threading.Thread(target=_cronometrar, args=(cpu, "receptor", rx.executar), daemon=True)]
+    erros = {}
+    envio = threading.Thread(target=lambda: erros.update(executar_todas(transferencias)), daemon=True)
+    cpu0 = time.process_time()
+    for th in threads:
+        th.start()
+    tx.iniciar()
+    inicio = time.monotonic()
+    envio.start()
+    envio.join(tempo_max)
+    esgotado = envio.is_alive()
+    tx.fechar()  # esgotado: destrava os laços de envio (RuntimeError em cada transferência)
+    envio.join()
+    duracao = time.monotonic() - inicio
+    roteador.stop()
+    rx.parar()
+    for th in threads:
+        th.join()
+    cpu_total = time.process_time() - cpu0
+
+    conexoes = list(rx.conexoes.values())
+    entregue = sum(x.recebidos for x in conexoes)
+    pacotes = sum(t.next_seq_num for t in transferencias)
+    reenviados = sum(t.pacotes_reenviados for t in transferencias)
+    mb = entregue / 1e6
+    # com o motor threads o roteador usa várias threads: a CPU dele fica junto com a do emissor
+    cpu_roteador = cpu.get("roteador") if motor == "selectors" else None
+    contadores = roteador.metrics.snapshot()["counters"]
+    fwd = contadores.get("fwd", {})
+    return {
+        **cenario, "tamanho": tamanho, "motor": motor, "semente": semente,
+        "concluido": not esgotado and not erros and len(conexoes) == c["conexoes"] and all(x.concluida for x in conexoes),
+        "integro": len(conexoes) == c["conexoes"] and all(x.recebidos == tamanho and x.crc == crc_esperado for x in conexoes),
+        "tempo_s": round(duracao, 4),
+        "goodput_mb_s": round(mb / duracao, 4),
+        "pacotes": pacotes,
+        "reenviados": reenviados,
+        "razao_retransmissao": round(reenviados / pacotes, 4) if pacotes else 0.0,
+        "cpu_s": round(cpu_total, 4),
+        "cpu_ms_por_mb": round(cpu_total * 1000 / mb, 2) if mb else None,
+        "cpu_roteador_s": None if cpu_roteador is None else round(cpu_roteador, 4),
+        "cpu_receptor_s": round(cpu["receptor"], 4),
+        "cpu_emissor_s": round(cpu_total - cpu["receptor"] - (cpu_roteador or 0), 4),
+        "roteador_descartes": sum(fwd.get(a, {}).get("packets", 0) for a in ("drop", "queue_drop")),
+        "roteador_corrompidos": fwd.get("corrupt", {}).get("packets", 0),
+        "receptor_corrompidos": rx.corrompidos,
+        "receptor_duplicados": rx.duplicados,
+    }
+
+
+def medianas(resultados):
+    """{chave do cenário: {métrica: mediana das repetições}}."""
+    grupos = {}
+    for r in resultados:
+        grupos.setdefault(chave(r), []).append(r)
+    return {k: {m: statistics.median(r[m] for r in rs if r[m] is not None) for m in METRICAS
+                if any(r[m] is not None for r in rs)}
+            for k, rs in grupos.items()}
+
+
+def comparar(resultados, base, tolerancia):
+    """Linhas de regressão: métricas de SENTIDO piores que a base além da tolerância relativa,
+    ou execuções que falharam (não concluídas ou dados errados) num cenário que passava."""
+    atual, anterior = medianas(resultados), medianas(base)
+    passava = {chave(r) for r in base if r["concluido"] and r["integro"]}
+    regressoes = []
+    for r in resultados:
+        if chave(r) in passava and not (r["concluido"] and r["integro"]):
+            cenario = " ".join(f"{n}={v}" for n, v in chave(r))
+            regressoes.append(f"falha (concluido={r['concluido']}, integro={r['integro']}, semente={r['semente']}) [{cenario}]")
+    for k, m in atual.items():
+        if k not in anterior:
+            continue
+        for metrica, sentido in SENTIDO.items():
+            if metrica not in m or not anterior[k].get(metrica):
+                continue
+            variacao = (m[metrica] - anterior[k][metrica]) / anterior[k][metrica]
+            if variacao * sentido < -tolerancia:
+                cenario = " ".join(f"{n}={v}" for n, v in k)
+                regressoes.append(f"{metrica}: {anterior[k][metrica]:.2f} -> {m[metrica]:.2f} ({variacao:+.0%}) [{cenario}]")
+    return regressoes
+
+
+def lista(tipo):
+    return lambda texto: [tipo(v) for v in texto.split(",")]
+
+
+# --- PRINCIPAL ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do emissor/roteador/receptor em processo (loopback)")
+    for nome, (tipo, padrao, ajuda) in GRADE.items():
+        parser.add_argument("--" + nome.replace("_", "-"), dest=nome, type=lista(tipo), default=lista(tipo)(padrao),
+                            help=f"{ajuda} (lista separada por virgula; padrao {padrao})")
+    parser.add_argument("--tamanho", type=int, default=2_000_000, help="Bytes enviados por conexao")
+    parser.add_argument("--repeticoes", type=int, default=1, help="Execucoes de cada cenario (sementes seed, seed+1, ...)")
+    parser.add_argument("--seed", type=int, default=1, help="Semente do roteador e dos dados")
+    parser.add_argument("--motor", choices=["selectors", "threads"], default="selectors", help="Motor do roteador (so com selectors a CPU do roteador sai separada)")
+    parser.add_argument("--batch", type=int, default=8, help="(motor selectors) datagramas lidos por socket a cada despertar")
+    parser.add_argument("--reorder-window", type=int, default=3, help="Janela de reordenacao do roteador")
+    parser.add_argument("--tempo-max", type=float, default=60.0, help="Limite por execucao (s); estourado, a execucao conta como nao concluida")
+    parser.add_argument("--json", type=str, default="", help="Grava ambiente e resultados em JSON")
+    parser.add_argument("--csv", type=str, default="", help="Grava os resultados em CSV (uma linha por execucao)")
+    parser.add_argument("--base", type=str, default="", help="JSON de uma execucao anterior: aponta regressoes de goodput e CPU/MB")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Piora relativa tolerada em relacao a --base")
+    args = parser.parse_args()
+    grade = {nome: getattr(args, nome) for nome in GRADE}
+    for modo in grade["modo"]:
+        if modo not in ("gbn", "sr"):
+            parser.error(f"--modo invalido: {modo}")
+    for nome in grade["controle"]:
+        if nome not in CONTROLADORES:
+            parser.error(f"--controle invalido: {nome}")
+    for nome in grade["checksum"]:
+        if nome not in ("internet", "crc32"):
+            parser.error(f"--checksum invalido: {nome}")
+    if not all(1 <= j <= JANELA_SERIAL_MAX for j in grade["janela"]):
+        parser.error(f"--janela deve estar entre 1 e {JANELA_SERIAL_MAX}")
+    if not all(1 <= p <= MAX_PAYLOAD for p in grade["payload"]):
+        parser.error(f"--payload deve estar entre 1 e {MAX_PAYLOAD}")
+    if not all(1 <= n <= 0xFFFF for n in grade["conexoes"]):
+        parser.error("--conexoes deve estar entre 1 e 65535")
+    if args.tamanho < 1 or args.repeticoes < 1:
+        parser.error("--tamanho e --repeticoes devem ser >= 1")
+    emissor.verboso = False
+    receptor.verboso = False
+
+    inicio = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "dados.bin")
+        dados = random.Random(args.seed).randbytes(args.tamanho)
+        with open(caminho, "wb") as f:
+            f.write(dados)
+        crc_esperado = zlib.crc32(dados)
+        del dados
+
+        # só as colunas que variam identificam o cenário na tabela
+        variando = [n for n in GRADE if len(grade[n]) > 1]
+        print(f"{'cenario':<40} {'tempo_s':>8} {'MB/s':>8} {'retx':>6} {'ms_cpu/MB':>10}  ok")
+        resultados = []
+        for cenario in cenarios(grade):
+            for rep in range(args.repeticoes):
+                # o emissor avisa retransmissões mesmo sem verboso: fora da tabela
+                with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+                    r = medir(cenario, caminho, crc_esperado, args.tamanho, args.seed + rep, args.motor, args.batch,
+                              args.reorder_window, args.tempo_max)
+                resultados.append(r)
+                nome = " ".join(f"{n}={cenario[n]}" for n in variando) or "padrao"
+                ok = "ok" if r["concluido"] and r["integro"] else ("CORROMPIDO" if r["concluido"] else "FALHOU")
+                print(f"{nome:<40} {r['tempo_s']:>8.2f} {r['goodput_mb_s']:>8.2f} {r['razao_retransmissao']:>6.3f} "
+                      f"{r['cpu_ms_por_mb'] or 0:>10.1f}  {ok}", flush=True)
+
+    if args.json:
+        ambiente = {"python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count(),
+                    "comando": sys.argv[1:], "inicio": inicio}
+        with open(args.json, "w") as f:
+            json.dump({"ambiente": ambiente, "resultados": resultados}, f, indent=1)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(resultados[0]))
+            w.writeheader()
+            w.writerows(resultados)
+    if args.base:
+        with open(args.base) as f:
+            regressoes = comparar(resultados, json.load(f)["resultados"], args.tolerancia)
+        for linha in regressoes:
+            print("REGRESSAO", linha)
+        if regressoes:
+            sys.exit(1)
+        print(f"Sem regressoes em relacao a {args.base} (tolerancia {args.tolerancia:.0%})")
@@ -0,0 +1,84 @@
+"""Checksums dos pacotes: soma da Internet (RFC 1071) rápida e CRC32.
+
+A soma de complemento de um de palavras de 16 bits é congruente, mod 0xFFFF, ao
+valor do buffer lido como um inteiro big-endian (2^16 = 1 mod 0xFFFF). Então basta
+um int.from_bytes e um resto, em C, em vez de um laço Python por palavra; aceita
+bytes, bytearray ou memoryview sem copiar para concatenar cabeçalho e dados.
+
+Uso: python checksum.py  (benchmark de 50 B a 64 KB)
+"""
+import os
+import time
+import zlib
+
+
+def soma16(dados):
+    """Soma de complemento de um (já dobrada, sem inverter) das palavras de 16 bits de dados."""
+    n = int.from_bytes(dados, 'big')
+    if len(dados) & 1:
+        n <<= 8  # byte final completado com zero
+    r = n % 0xFFFF
+    # a soma com carry circular de palavras não todas nulas nunca dá 0: dá 0xFFFF
+    return 0xFFFF if r == 0 and n else r
+
+
+def internet(*partes):
+    """Checksum da Internet sobre a concatenação das partes (todas, menos a última, de tamanho par)."""
+    s = 0
+    for p in partes:
+        s += soma16(p)
+    while s >> 16:
+        s = (s & 0xFFFF) + (s >> 16)
+    return ~s & 0xFFFF
+
+
+def crc32(*partes):
+    """CRC32 (zlib) sobre a concatenação das partes."""
+    c = 0
+    for p in partes:
+        c = zlib.crc32(p, c)
+    return c
+
+
+def internet_referencia(dados):
+    """O laço original palavra a palavra (referência para testes e benchmark)."""
+    if len(dados) % 2 != 0:
+        dados = bytes(dados) + b'\0'
+    soma = 0
+    for i in range(0, len(dados), 2):
+        palavra = (dados[i] << 8) + dados[i + 1]
+        soma += palavra
+        soma = (soma & 0xFFFF) + (soma >> 16)
+    return ~soma & 0xFFFF
+
+
+ALGORITMOS = {
+    "referencia": internet_referencia,
+    "internet": internet,
+    "crc32": crc32,
+}
+
+
+def benchmark(tamanhos=(50, 512, 1472, 8192, 65507), tempo_min=0.2):
+    """Tempo por chamada (µs) e vazão (MB/s) de cada algoritmo para cada tamanho de payload."""
+    linhas = []
+    for tamanho in tamanhos:
+        dados = memoryview(os.urandom(tamanho))
+        assert internet(dados) == internet_referencia(dados)
+        for nome, f in ALGORITMOS.items():
+            n, decorrido = 0, 0.0
+            t0 = time.perf_counter()
+            while decorrido < tempo_min:
+                for _ in range(10):
+                    f(dados)
+                n += 10
+                decorrido = time.perf_counter() - t0
+            us = decorrido / n * 1e6
+            linhas.append((tamanho, nome, us, tamanho / us))
+    return linhas
+
+
+if __name__ == "__main__":
+    print(f"{'tamanho':>8} {'algoritmo':>11} {'us/chamada':>11} {'MB/s':>9}")
+    for tamanho, nome, us, mbs in benchmark():
+        print(f"{tamanho:>8} {nome:>11} {us:>11.2f} {mbs:>9.1f}")
@@ -1,142 +1,744 @@
+import argparse
+import heapq
+import io
+import itertools
+import mmap
+import os
 import socket
+import sys
 import threading
-import struct
 import time
-import json
+
+from checksum import crc32, internet
+from protocolo import (ACK_F_CRC32, CABECALHO_V1, CABECALHO_V2, CONN, F_CONN, F_CRC32, F_FIN, JANELA_SERIAL_MAX,
+                       MAGIC_DADOS, SEQ_V1, TRAILER_CRC32, agora_us, desembrulhar, ler_ack, rtt_de_eco)
 
 # --- CONFIGURAÇÕES ---
 ROUTER_ADDR = ('127.0.0.1', 9000)   # IP do roteador (porta corrigida)
 SENDER_ADDR = ('127.0.0.1', 9001)   # IP local
-WINDOW_SIZE = 5 #tamanho da janela
-TIMEOUT = 20 #tempo de timeout em segundos
-MAX_DATA_SIZE = 50 #tamanho máximo dos dados em bytes
-
-# --- VARIÁVEIS ---
-base = 0 #menor número de sequência não reconhecido
-next_seq_num = 0 #próximo número de sequência a ser usado
-buffer_pacotes = {} #armazenar pacotes enviados mas não reconhecidos
-lock = threading.Lock() #trava para sincronização de threads
-timer = None # referencia ao timer para timeout
-emissor_ativo = True #indica se o emissor está ativo
-
-# --- CHECKSUM ---
-def calcular_checksum(dados: bytes) -> int:
-    if len(dados) % 2 != 0:
-        dados += b'\0'
-    soma = 0
-    for i in range(0, len(dados), 2):
-        palavra = (dados[i] << 8) + dados[i + 1]
-        soma += palavra
-        soma = (soma & 0xFFFF) + (soma >> 16)
-    return ~soma & 0xFFFF
+WINDOW_SIZE = 5 #tamanho da janela fixa (e janela inicial dos controladores)
+JANELA_MAX = 1024 #teto da janela dinâmica (precisa ficar abaixo de 2^15 por causa dos seqs de 16 bits)
+TIMEOUT_INICIAL = 1.0 #RTO antes da primeira amostra de RTT, em segundos
+TIMEOUT_MIN = 0.05 #piso do RTO
+TIMEOUT_MAX = 20 #teto do RTO com backoff (o antigo timeout fixo)
+DUPACKS_FAST_RETRANSMIT = 3 #ACKs duplicados que disparam retransmissão rápida
+MAX_DATA_SIZE = 50 #tamanho máximo dos dados em bytes (padrão de --payload)
+MAX_PAYLOAD = 65507 - CABECALHO_V2.size - CONN.size - TRAILER_CRC32.size #maior payload que cabe num datagrama UDP
+LEITURA_ANTECIPADA = 1 << 20 #bytes lidos por vez de stdin/pipes
+
+verboso = True #log por pacote (-q desliga)
+
+def info(msg):
+    if verboso:
+        print(msg)
+
+# --- CONTROLE DE JANELA ---
+class JanelaFixa:
+    """Janela constante: o comportamento original do emissor."""
+    nome = "fixa"
+
+    def __init__(self, inicial=WINDOW_SIZE, maxima=JANELA_MAX):
+        self.cwnd = float(inicial)
+        self.maxima = maxima
+
+    def janela(self):
+        return max(1, min(self.maxima, int(self.cwnd)))
+
+    def ao_ack(self, novos, amostra_rtt=None):
+        pass
+
+    def ao_perda_rapida(self):
+        pass
+
+    def ao_timeout(self):
+        pass
+
+
+class JanelaReno(JanelaFixa):
+    """AIMD estilo Reno: slow start até ssthresh, depois +1 pacote por RTT; perda corta pela metade."""
+    nome = "reno"
+
+    def __init__(self, inicial=1, maxima=JANELA_MAX, ssthresh=64):
+        super().__init__(inicial, maxima)
+        self.ssthresh = float(ssthresh)
+
+    def ao_ack(self, novos, amostra_rtt=None):
+        for _ in range(novos):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.maxima)
+
+    def ao_perda_rapida(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+
+    def ao_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = 1.0
+
+
+class JanelaAtraso(JanelaReno):
+    """Baseada em atraso (estilo Vegas): mantém entre alfa e beta pacotes enfileirados no caminho.
+
+    fila estimada = cwnd * (1 - rtt_base / rtt); cresce abaixo de alfa, recua acima de beta.
+    Perdas continuam tratadas como no Reno.
+    """
+    nome = "atraso"
+
+    def __init__(self, inicial=1, maxima=JANELA_MAX, ssthresh=64, alfa=2, beta=4):
+        super().__init__(inicial, maxima, ssthresh)
+        self.alfa = alfa
+        self.beta = beta
+        self.rtt_base = None
+
+    def ao_ack(self, novos, amostra_rtt=None):
+        if amostra_rtt is None or amostra_rtt <= 0:
+            return super().ao_ack(novos)
+        self.rtt_base = amostra_rtt if self.rtt_base is None else min(self.rtt_base, amostra_rtt)
+        fila = self.cwnd * (1 - self.rtt_base / amostra_rtt)
+        if fila > self.beta:
+            self.ssthresh = min(self.ssthresh, self.cwnd)
+            self.cwnd = max(2.0, self.cwnd - novos / self.cwnd)
+        elif fila < self.alfa:
+            super().ao_ack(novos)
+
+
+CONTROLADORES = {c.nome: c for c in (JanelaFixa, JanelaReno, JanelaAtraso)}
 
 # --- CRIAR PACOTE ---
-def criar_pacote(seq_num, dados: bytes):
-    header_sem_checksum = struct.pack("!H", seq_num) + dados
-    checksum = calcular_checksum(header_sem_checksum)
-    return struct.pack("!HH", seq_num, checksum) + dados
-
-# --- TIMEOUT ---
-def evento_timeout(sock):
-    global timer
-    if not emissor_ativo:
-        return
-    with lock:
-        print(f"\n[Emissor] TIMEOUT! Reenviando de {base} até {next_seq_num - 1}")
-        for i in range(base, next_seq_num):
-            if i in buffer_pacotes:
-                sock.sendto(buffer_pacotes[i], ROUTER_ADDR)
-                print(f"[Emissor] Reenviado pacote {i}.")
-        if timer:
-            timer.cancel()
-        timer = threading.Timer(TIMEOUT, evento_timeout, args=(sock,))
-        timer.start()
-
-# --- RECEBER ACKs ---
-def escutar_acks(sock):
-    global base, timer, emissor_ativo
-    while emissor_ativo:
+# checksum.internet soma cabeçalho e dados por partes: nada de concatenar só para o checksum
+def criar_pacote(seq_num, dados, flags=0, v2=True, crc=False, conn=None):
+    """Partes do datagrama (cabeçalho, dados[, trailer]); os dados não são copiados.
+
+    v2=False monta o formato antigo (seq, checksum); crc troca a soma de 16 bits pelo
+    trailer CRC32; conn estende o cabeçalho v2 com o id da conexão (F_CONN).
+    """
+    seq_num &= 0xFFFF  # no fio só os 16 bits de baixo; o receptor desembrulha
+    if not v2:
+        checksum = internet(SEQ_V1.pack(seq_num), dados)
+        return [CABECALHO_V1.pack(seq_num, checksum), dados]
+    ts = agora_us()
+    extensao = b""
+    if conn is not None:
+        flags |= F_CONN
+        extensao = CONN.pack(conn)
+    if crc:
+        cabecalho = CABECALHO_V2.pack(MAGIC_DADOS, flags | F_CRC32, 0, seq_num, ts) + extensao
+        return [cabecalho, dados, TRAILER_CRC32.pack(crc32(cabecalho, dados))]
+    checksum = internet(CABECALHO_V2.pack(MAGIC_DADOS, flags, 0, seq_num, ts), extensao, dados)
+    return [CABECALHO_V2.pack(MAGIC_DADOS, flags, checksum, seq_num, ts) + extensao, dados]
+
+if hasattr(socket.socket, "sendmsg"):
+    def enviar_partes(sock, partes, destino=ROUTER_ADDR):
+        # scatter/gather: o kernel junta cabeçalho e fatia de dados, sem cópia em Python
+        return sock.sendmsg(partes, (), 0, destino)
+else:  # Windows não tem sendmsg
+    def enviar_partes(sock, partes, destino=ROUTER_ADDR):
+        return sock.sendto(b"".join(partes), destino)
+
+# --- FONTES DE DADOS ---
+class FonteMmap:
+    """Arquivo comum mapeado em memória: cada pacote é uma fatia, sem cópia."""
+
+    def __init__(self, f):
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        self.pos = 0
+        self.tamanho = len(self.mm)
+
+    def ler(self, n):
+        fatia = self.view[self.pos:self.pos + n]
+        self.pos += len(fatia)
+        return fatia
+
+    def fechar(self):
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            pass  # ainda há fatias vivas; o GC fecha o mapeamento
+
+
+class FonteLeitura:
+    """stdin, pipe ou texto: lê blocos de LEITURA_ANTECIPADA e devolve fatias deles.
+
+    Um bloco fica vivo só enquanto algum pacote dele está na janela, então a memória
+    fica limitada a ~janela * payload + um bloco.
+    """
+
+    def __init__(self, f, bloco=LEITURA_ANTECIPADA):
+        self.f = f
+        self.bloco = bloco
+        self.buf = memoryview(b"")
+        self.pos = 0
+        self.tamanho = None
+
+    def ler(self, n):
+        sobra = len(self.buf) - self.pos
+        if sobra < n:
+            # bloco novo (o anterior segue vivo nas fatias da janela): a sobra vai para o
+            # começo e o arquivo lê direto no resto, sem um bytes intermediário
+            novo = bytearray(sobra + max(self.bloco, n))
+            novo[:sobra] = self.buf[self.pos:]
+            lidos = self.f.readinto(memoryview(novo)[sobra:])
+            if lidos:
+                self.buf = memoryview(novo)[:sobra + lidos]
+                self.pos = 0
+        fatia = self.buf[self.pos:self.pos + n]
+        self.pos += len(fatia)
+        return fatia
+
+    def fechar(self):
+        self.f.close()
+
+
+def abrir_fonte(caminho):
+    if caminho == "-":
+        return FonteLeitura(sys.stdin.buffer)
+    f = open(caminho, "rb")
+    if os.fstat(f.fileno()).st_size > 0:
+        try:
+            return FonteMmap(f)
+        except (ValueError, OSError):
+            pass  # não mapeável (pipe nomeado, /proc...): lê em blocos
+    return FonteLeitura(f)
+
+# --- TRANSFERÊNCIA ---
+class Transferencia:
+    """Um fluxo de dados do GoBackNSender, com janela, timers, RTO, SACK e estatísticas próprios.
+
+    Criada por GoBackNSender.abrir(); executar() envia a fonte inteira e volta quando o FIN
+    é confirmado. Os demais métodos rodam com a trava do emissor (compartilhada por todas as
+    transferências dele), chamados pela thread de ACKs ou pelo serviço de timer.
+    """
+
+    def __init__(self, emissor, fonte, conn=None, controle=None, payload=MAX_DATA_SIZE,
+                 modo_sr=False, formato_v2=True, pedir_crc32=False):
+        self.emissor = emissor
+        self.fonte = fonte
+        self.conn = conn #id no cabeçalho (F_CONN); None = transferência única, sem id no fio
+        self.controle = controle or JanelaFixa() #controlador de janela (JanelaFixa/JanelaReno/JanelaAtraso)
+        self.payload = payload #bytes de dados por pacote
+        self.nome = "[Emissor]" if conn is None else f"[Emissor #{conn}]"
+        self.cond = threading.Condition(emissor.lock) #acorda o laço de envio (ACK, fim)
+        self.base = 0 #menor número de sequência não reconhecido
+        self.next_seq_num = 0 #próximo número de sequência a ser usado
+        self.buffer_pacotes = {} #seq -> dados (fatia memoryview) enviados e não reconhecidos; liberados no ACK
+        self.seq_fin = None #seq do pacote FIN, quando já enviado
+        self.prazo = None #instante (monotonic) em que o timer de retransmissão expira; None = parado
+        self.tempo_envio = {} #seq -> instante do primeiro envio (amostra de RTT)
+        self.retransmitidos = set() #seqs já reenviados: não geram amostra de RTT (regra de Karn)
+        self.srtt = None #RTT suavizado
+        self.rttvar = None #variação do RTT
+        self.rto = TIMEOUT_INICIAL #timeout de retransmissão atual
+        self.dupacks = 0 #ACKs duplicados seguidos para a base atual
+        self.historico_janela = [] #(instante, janela) a cada mudança
+        self.modo_sr = modo_sr #Selective Repeat; cai para Go-Back-N se o receptor não mandar SACK
+        self.prazos = {} #SR: seq -> prazo do timer individual do pacote
+        self.sackeados = set() #SR: seqs acima da base já confirmados por SACK
+        self.reenviados_rapido = set() #SR: buracos já reenviados pela recuperação via SACK
+        self.em_recuperacao = None #next_seq_num no início da recuperação (SR: uma redução de janela por episódio; GBN: "recover" da RFC 6582)
+        self.formato_v2 = formato_v2 #cabeçalho v2 com timestamp e ACK binário (False = formato antigo)
+        self.rwnd_receptor = None #janela anunciada pelo receptor (só no ACK binário)
+        self.pedir_crc32 = pedir_crc32 #usa CRC32 assim que o receptor anunciar suporte
+        self.usar_crc32 = False #receptor confirmou suporte (flag ACK_F_CRC32): pacotes novos levam CRC32
+        self.enviados = 0 #bytes de dados enviados (sem reenvios)
+        self.pacotes_reenviados = 0
+        self.bytes_reenviados = 0
+        self.duracao = None #segundos do primeiro envio à confirmação do FIN
+        self.registrar_janela()
+
+    # --- RTO ADAPTATIVO (Jacobson/Karels, RFC 6298) ---
+    def atualizar_rto(self, amostra):
+        if self.srtt is None:
+            self.srtt = amostra
+            self.rttvar = amostra / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - amostra)
+            self.srtt = 0.875 * self.srtt + 0.125 * amostra
+        self.rto = min(TIMEOUT_MAX, max(TIMEOUT_MIN, self.srtt + 4 * self.rttvar))
+
+    def registrar_janela(self):
+        j = self.controle.janela()
+        if not self.historico_janela or self.historico_janela[-1][1] != j:
+            self.historico_janela.append((time.monotonic(), j))
+
+    def janela_efetiva(self):
+        # janela do controlador limitada pelo que o receptor anuncia
+        j = self.controle.janela()
+        return j if self.rwnd_receptor is None else max(1, min(j, self.rwnd_receptor))
+
+    # --- TIMERS ---
+    def reiniciar_timer(self):
+        # só move o prazo; quem espera é o serviço de timer do emissor
+        self.prazo = time.monotonic() + self.rto
+        self.emissor.agendar(self.prazo, self, None)
+
+    def parar_timer(self):
+        self.prazo = None
+
+    def armar_prazo(self, seq):
+        # SR: (re)inicia o timer individual de seq
+        t = time.monotonic() + self.rto
+        self.prazos[seq] = t
+        self.emissor.agendar(t, self, seq)
+
+    def prazo_vigente(self, prazo, seq):
+        # entrada do heap do emissor ainda vale? (timers movidos ou parados ficam obsoletos)
+        if seq is None:
+            return self.prazo == prazo
+        return self.modo_sr and self.prazos.get(seq) == prazo
+
+    # --- ENVIO ---
+    def enviar_pacote(self, seq):
+        # monta e envia o pacote seq a partir de buffer_pacotes; devolve os bytes enviados
+        flags = F_FIN if seq == self.seq_fin else 0
+        partes = criar_pacote(seq, self.buffer_pacotes[seq], flags, self.formato_v2, self.usar_crc32, self.conn)
+        return enviar_partes(self.emissor.sock, partes, self.emissor.destino)
+
+    def reenviar_pacote(self, i):
+        if i not in self.buffer_pacotes:
+            return
+        # cabeçalho refeito a cada envio: no v2 o carimbo novo faz o eco no ACK medir o RTT
+        # desta cópia, sem a ambiguidade de Karn
+        self.bytes_reenviados += self.enviar_pacote(i)
+        self.retransmitidos.add(i)
+        self.pacotes_reenviados += 1
+        info(f"{self.nome} Reenviado pacote {i}.")
+
+    def reenviar_janela(self, motivo):
+        # Go-Back-N: reenvia de base até next_seq_num - 1. As cópias que já tinham chegado voltam
+        # como ACKs duplicados: até a base passar de em_recuperacao eles não disparam outra rodada
+        self.em_recuperacao = self.next_seq_num
+        self.dupacks = 0
+        print(f"\n{self.nome} {motivo}! Reenviando de {self.base} até {self.next_seq_num - 1} (RTO={self.rto:.3f}s)")
+        for i in range(self.base, self.next_seq_num):
+            self.reenviar_pacote(i)
+
+    # --- TIMEOUT ---
+    def evento_timeout(self):
+        self.rto = min(TIMEOUT_MAX, self.rto * 2)  # backoff exponencial
+        self.dupacks = 0
+        self.controle.ao_timeout()
+        self.registrar_janela()
+        self.reenviar_janela("TIMEOUT")
+        self.reiniciar_timer()
+
+    # --- SELECTIVE REPEAT ---
+    def cair_para_gbn(self):
+        # O receptor não anuncia SACK: segue como Go-Back-N com um timer só
+        self.modo_sr = False
+        self.prazos.clear()
+        self.sackeados.clear()
+        print(f"{self.nome} Receptor sem SACK: usando Go-Back-N.")
+        if self.base < self.next_seq_num:
+            self.reiniciar_timer()
+
+    def timeout_pacote(self, seq):
+        # SR: só o pacote vencido é reenviado. Backoff e reação da janela apenas quando
+        # vence o mais antigo (base), como o timer único do TCP.
+        if seq == self.base:
+            self.rto = min(TIMEOUT_MAX, self.rto * 2)
+            self.controle.ao_timeout()
+            self.registrar_janela()
+            self.em_recuperacao = self.next_seq_num
+        print(f"\n{self.nome} TIMEOUT do pacote {seq} (RTO={self.rto:.3f}s)")
+        self.reenviar_pacote(seq)
+        self.armar_prazo(seq)
+
+    def processar_sack(self, blocos):
+        # SR: marca os blocos [a, b] (inclusivos) e reenvia buracos considerados perdidos:
+        # os que têm pelo menos DUPACKS_FAST_RETRANSMIT seqs sackeados acima (RFC 6675).
+        novos = False
+        for a, b in blocos:
+            for i in range(max(a, self.base), min(b, self.next_seq_num - 1) + 1):
+                if i not in self.sackeados:
+                    self.sackeados.add(i)
+                    self.prazos.pop(i, None)
+                    novos = True
+        if not novos:
+            return
+        acima = 0
+        perdidos = []
+        for i in range(max(self.sackeados), self.base - 1, -1):
+            if i in self.sackeados:
+                acima += 1
+            elif acima >= DUPACKS_FAST_RETRANSMIT and i not in self.reenviados_rapido:
+                perdidos.append(i)
+        if not perdidos:
+            return
+        if self.em_recuperacao is None:
+            self.em_recuperacao = self.next_seq_num
+            self.controle.ao_perda_rapida()
+            self.registrar_janela()
+        print(f"\n{self.nome} SACK: reenviando buracos {sorted(perdidos)} (RTO={self.rto:.3f}s)")
+        for i in reversed(perdidos):
+            self.reenviados_rapido.add(i)
+            self.reenviar_pacote(i)
+            self.armar_prazo(i)
+
+    # --- ACKs ---
+    def ao_receber_ack(self, ack, sack, ts_eco, rwnd, flags):
+        # chamado pela thread de ACKs do emissor, já com a trava
+        info(f"{self.nome} Recebeu ACK({ack})" + (f" SACK={sack}" if sack else ""))
+        # ACK binário leva 32 bits: reconstrói o seq completo em torno da base
+        ack = desembrulhar(ack, self.base - 1, 32)
+        if sack:
+            sack = [(desembrulhar(a, self.base, 32), desembrulhar(b, self.base, 32)) for a, b in sack]
+        if self.modo_sr and sack is None:
+            self.cair_para_gbn()
+        if rwnd is not None:
+            self.rwnd_receptor = rwnd
+        if self.pedir_crc32 and not self.usar_crc32 and flags & ACK_F_CRC32:
+            self.usar_crc32 = True
+            print(f"{self.nome} Receptor aceita CRC32: pacotes novos com CRC32.")
+        if ack + 1 > self.base:
+            old_base = self.base
+            self.base = ack + 1
+            self.dupacks = 0
+            enviado = self.tempo_envio.get(ack)
+            amostra = None
+            if ts_eco:
+                # ACK binário: o receptor ecoa o carimbo do pacote que gerou este ACK
+                amostra = rtt_de_eco(ts_eco)
+            # Karn: nada de amostra de pacote reenviado; no SR, nem de um já sackeado
+            # (o ACK cumulativo só andou agora porque um buraco abaixo dele foi preenchido)
+            elif enviado is not None and ack not in self.retransmitidos and ack not in self.sackeados:
+                amostra = time.monotonic() - enviado
+            if amostra is not None:
+                self.atualizar_rto(amostra)
+            self.controle.ao_ack(self.base - old_base, amostra)
+            self.registrar_janela()
+            for i in range(old_base, self.base):
+                self.buffer_pacotes.pop(i, None)  # libera a fatia (e o bloco/mapa por trás dela)
+                self.tempo_envio.pop(i, None)
+                self.retransmitidos.discard(i)
+                self.prazos.pop(i, None)
+                self.sackeados.discard(i)
+                self.reenviados_rapido.discard(i)
+            info(f"{self.nome} Base moveu de {old_base} para {self.base} (next_seq_num={self.next_seq_num})")
+            if self.modo_sr:
+                if self.em_recuperacao is not None and self.base >= self.em_recuperacao:
+                    self.em_recuperacao = None
+            else:
+                if self.em_recuperacao is not None and self.base > self.em_recuperacao:
+                    self.em_recuperacao = None  # algo enviado depois da rodada foi confirmado
+                if self.base == self.next_seq_num:
+                    self.parar_timer()
+                    info(f"{self.nome} Timer parado - TODOS OS PACOTES CONFIRMADOS!")
+                else:
+                    self.reiniciar_timer()
+                    info(f"{self.nome} Timer reiniciado. Aguardando ACKs de {self.base} até {self.next_seq_num-1}")
+            self.cond.notify()  # a janela andou: acorda o laço de envio
+        elif ack + 1 == self.base and self.base < self.next_seq_num and not self.modo_sr and self.em_recuperacao is None:
+            self.dupacks += 1
+            if self.dupacks == DUPACKS_FAST_RETRANSMIT:
+                self.controle.ao_perda_rapida()
+                self.registrar_janela()
+                self.reenviar_janela(f"{self.dupacks} ACKs duplicados (retransmissão rápida)")
+                self.reiniciar_timer()
+        if self.modo_sr and sack:
+            self.processar_sack(sack)
+
+    # --- LAÇO DE ENVIO ---
+    def _enfileirar(self, seq, dados):
+        # guarda, envia e arma o timer do pacote seq (com a trava)
+        self.buffer_pacotes[seq] = dados
+        self.tempo_envio[seq] = time.monotonic()
+        self.enviar_pacote(seq)
+        if self.modo_sr:
+            self.armar_prazo(seq)
+        elif self.prazo is None or self.base == seq:
+            self.reiniciar_timer()
+        self.next_seq_num = seq + 1
+
+    def executar(self):
+        """Envia a fonte inteira e o FIN; volta quando tudo for confirmado (RuntimeError se o emissor fechar antes)."""
+        emissor = self.emissor
+        janela_livre = lambda: self.next_seq_num < self.base + self.janela_efetiva() or not emissor.ativo
+        inicio = time.monotonic()
+        ultimo = 0 #tamanho do último bloco enviado
+        try:
+            while True:
+                bloco = self.fonte.ler(self.payload)  # leitura fora da trava: não atrasa os ACKs
+                if not bloco:
+                    break
+                with self.cond:
+                    # Janela cheia: dorme até um ACK abrir espaço (sem polling)
+                    self.cond.wait_for(janela_livre)
+                    if not emissor.ativo:
+                        raise RuntimeError("thread de ACKs encerrou")
+                    seq = self.next_seq_num
+                    self._enfileirar(seq, bloco)
+                    self.enviados += len(bloco)
+                    ultimo = len(bloco)
+                    info(f"{self.nome} Pacote {seq} enviado. (janela: {self.base} a {self.base+self.janela_efetiva()-1})")
+            del bloco
+
+            info(f"\n{self.nome} Todos os dados enviados. {self.enviados} bytes em {self.next_seq_num} pacotes")
+
+            with self.cond:
+                if self.formato_v2 or not 0 < ultimo < self.payload:
+                    # Pacote final (FIN): vazio; no v2 leva a flag F_FIN
+                    self.seq_fin = self.next_seq_num
+                    self._enfileirar(self.seq_fin, b'')
+                    info(f"{self.nome} FIN (seq {self.seq_fin}) enviado. base={self.base}, next_seq_num={self.next_seq_num}")
+                else:
+                    # v1: o receptor encerra no primeiro pacote curto, então o último bloco já é o fim;
+                    # um pacote vazio depois dele nunca seria confirmado
+                    self.seq_fin = self.next_seq_num - 1
+                self.cond.wait_for(lambda: self.base >= self.next_seq_num or not emissor.ativo)
+                if self.base < self.next_seq_num:
+                    raise RuntimeError("thread de ACKs encerrou")
+            self.duracao = time.monotonic() - inicio
+            info(f"{self.nome} Confirmação final recebida! base={self.base}, next_seq_num={self.next_seq_num}")
+        finally:
+            with self.cond:
+                self.parar_timer()
+                self.prazos.clear()
+                self.buffer_pacotes.clear()
+                emissor.transferencias.pop(self.conn, None)
+            self.fonte.fechar()
+
+    def resumo(self):
+        """Linhas de estatística da transferência concluída."""
+        linhas = []
+        if self.duracao:
+            linhas.append(f"{self.enviados} bytes em {self.duracao:.2f} s ({self.enviados / self.duracao / 1e6:.2f} MB/s)")
+        if self.srtt is not None:
+            linhas.append(f"RTT suavizado={self.srtt*1000:.1f} ms, RTO final={self.rto*1000:.1f} ms")
+        linhas.append(f"Reenvios ({'sr' if self.modo_sr else 'gbn'}): {self.pacotes_reenviados} pacotes, {self.bytes_reenviados} bytes")
+        linhas.append(f"Janela ({self.controle.nome}): final={self.controle.janela()}, "
+                      f"maxima={max(j for _, j in self.historico_janela)}, mudancas={len(self.historico_janela)}")
+        return [f"{self.nome} {l}" for l in linhas]
+
+
+# --- EMISSOR ---
+class GoBackNSender:
+    """Um socket UDP compartilhado por várias transferências simultâneas.
+
+    Cada transferência tem seu id de conexão no cabeçalho (F_CONN) e seus próprios seqs,
+    janela, timers e estatísticas. Uma thread lê os ACKs e os entrega à transferência do
+    conn ecoado no ACK; outra serve os timers de retransmissão de todas com um único heap.
+    Apesar do nome, as transferências também podem usar Selective Repeat (modo_sr=True).
+
+        emissor = GoBackNSender(destino=('127.0.0.1', 9000))
+        t = emissor.abrir(FonteLeitura(io.BytesIO(b"oi")), conn=1)
+        emissor.iniciar()
+        t.executar()
+        emissor.fechar()
+    """
+
+    def __init__(self, local=SENDER_ADDR, destino=ROUTER_ADDR):
+        self.destino = destino
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(local)
+        self.local = self.sock.getsockname()
+        self.lock = threading.Lock() #trava única: ACKs, timers e laços de envio de todas as transferências
+        self.cond_timer = threading.Condition(self.lock) #acorda o serviço de timer quando o próximo prazo muda
+        self.heap_prazos = [] #(prazo, desempate, transferencia, seq); seq None = timer único do Go-Back-N
+        self.desempate = itertools.count()
+        self.transferencias = {} #conn -> Transferencia em andamento
+        self.ativo = False
+        self.threads = []
+
+    def abrir(self, fonte, conn=None, **opcoes):
+        """Registra uma transferência da fonte com este id de conexão (None = sem id no fio)."""
+        with self.lock:
+            if conn in self.transferencias:
+                raise ValueError(f"conexão {conn} já em uso")
+            if conn is not None and not 0 <= conn <= 0xFFFF:
+                raise ValueError(f"id de conexão fora de 16 bits: {conn}")
+            if conn is not None and not opcoes.get("formato_v2", True):
+                raise ValueError("id de conexão exige o cabeçalho v2 (ACK binário)")
+            t = Transferencia(self, fonte, conn, **opcoes)
+            self.transferencias[conn] = t
+            return t
+
+    def iniciar(self):
+        self.ativo = True
+        self.threads = [threading.Thread(target=self.escutar_acks, daemon=True),
+                        threading.Thread(target=self.servico_timer, daemon=True)]
+        for th in self.threads:
+            th.start()
+
+    def fechar(self):
+        with self.lock:
+            self.ativo = False
+            self._acordar_todos()
         try:
-            dados_ack, _ = sock.recvfrom(1024)
-            s = dados_ack.decode('utf-8', errors='ignore').replace("'", '"').strip()
+            self.sock.shutdown(socket.SHUT_RDWR)  # destrava o recvfrom da thread de ACKs
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _acordar_todos(self):
+        # com a trava
+        self.cond_timer.notify()
+        for t in self.transferencias.values():
+            t.cond.notify()
+
+    def agendar(self, prazo, transferencia, seq):
+        # com a trava: entradas antigas da mesma transferência/seq ficam obsoletas e são
+        # descartadas ao chegar no topo (prazo_vigente)
+        entrada = (prazo, next(self.desempate), transferencia, seq)
+        heapq.heappush(self.heap_prazos, entrada)
+        if self.heap_prazos[0] is entrada:
+            self.cond_timer.notify()
+
+    def servico_timer(self):
+        # Uma única thread para os timers de retransmissão de todas as transferências: dorme
+        # até o menor prazo vigente (ou até alguém agendar um menor).
+        heap = self.heap_prazos
+        with self.cond_timer:
+            while self.ativo:
+                while heap and not heap[0][2].prazo_vigente(heap[0][0], heap[0][3]):
+                    heapq.heappop(heap)
+                if not heap:
+                    self.cond_timer.wait()
+                    continue
+                restante = heap[0][0] - time.monotonic()
+                if restante > 0:
+                    self.cond_timer.wait(restante)
+                    continue
+                _, _, t, seq = heapq.heappop(heap)
+                if seq is None:
+                    t.evento_timeout()
+                else:
+                    t.timeout_pacote(seq)
+
+    def escutar_acks(self):
+        # Demultiplexa pelo conn do ACK binário (ACK_F_CONN); ACK sem conn vai para a transferência sem id
+        while self.ativo:
             try:
-                ack = json.loads(s).get("ack_num")
-            except:
-                continue
-            if ack is None:
-                continue
-            print(f"[Emissor] Recebeu ACK({ack})")
-
-            with lock:
-                if ack + 1 > base:
-                    old_base = base
-                    base = ack + 1
-                    print(f"[Emissor] Base moveu de {old_base} para {base} (next_seq_num={next_seq_num})")
-                    if base == next_seq_num:
-                        if timer: timer.cancel()
-                        timer = None
-                        print("[Emissor] Timer parado - TODOS OS PACOTES CONFIRMADOS!")
-                    else:
-                        if timer: timer.cancel()
-                        timer = threading.Timer(TIMEOUT, evento_timeout, args=(sock,))
-                        timer.start()
-                        print(f"[Emissor] Timer reiniciado. Aguardando ACKs de {base} até {next_seq_num-1}")
-        except Exception:
-            break
+                dados_ack, _ = self.sock.recvfrom(1024)
+                r = ler_ack(dados_ack)
+                if r is None:
+                    continue
+                ack, sack, ts_eco, rwnd, flags, conn = r
+                with self.lock:
+                    t = self.transferencias.get(conn)
+                    if t is not None:
+                        t.ao_receber_ack(ack, sack, ts_eco, rwnd, flags)
+            except Exception:
+                break
+        with self.lock:
+            self.ativo = False
+            self._acordar_todos()
+
+
+def executar_todas(transferencias):
+    """Roda executar() de cada transferência na sua própria thread; devolve {conn: exceção} das que falharam."""
+    erros = {}
+
+    def rodar(t):
+        try:
+            t.executar()
+        except Exception as e:
+            erros[t.conn] = e
+
+    threads = [threading.Thread(target=rodar, args=(t,)) for t in transferencias]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return erros
 
 # --- PRINCIPAL ---
 if __name__ == "__main__":
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(SENDER_ADDR)
-    print(f"[Emissor] Escutando ACKs em {SENDER_ADDR}")
+    parser = argparse.ArgumentParser(description="Emissor Go-Back-N")
+    parser.add_argument("--janela", choices=sorted(CONTROLADORES), default="fixa", help="Controle de janela: fixa (WINDOW_SIZE), reno (AIMD) ou atraso (estilo Vegas)")
+    parser.add_argument("--tamanho-janela", type=int, default=WINDOW_SIZE, help="Tamanho da janela fixa")
+    parser.add_argument("--janela-max", type=int, default=JANELA_MAX, help="Teto da janela dinamica")
+    parser.add_argument("--modo", choices=["gbn", "sr"], default="gbn", help="Go-Back-N ou Selective Repeat com SACK (exige receptor com SACK)")
+    parser.add_argument("--ack", choices=["binario", "texto"], default="binario", help="binario: cabecalho v2 com timestamp e ACK binario; texto: formato antigo (seq, checksum) com ACK JSON")
+    parser.add_argument("--checksum", choices=["internet", "crc32"], default="internet", help="crc32: CRC32 em vez da soma de 16 bits, negociado com o receptor (so com --ack binario)")
+    parser.add_argument("--arquivo", type=str, default="", help="Envia este arquivo ('-' = stdin) em vez de uma linha digitada")
+    parser.add_argument("--payload", type=int, default=MAX_DATA_SIZE, help=f"Bytes de dados por pacote (ate {MAX_PAYLOAD}; so com --ack binario se diferente de {MAX_DATA_SIZE})")
+    parser.add_argument("--conexoes", type=int, default=1, help="Transferencias simultaneas dos mesmos dados pelo mesmo socket, com ids 1..N no cabecalho (so com --ack binario)")
+    parser.add_argument("--primeira-conexao", type=int, default=None, help="Id da primeira conexao (ids K..K+N-1); com ele mesmo uma conexao so leva id. Separa os ids de varios processos que dividem um receptor")
+    parser.add_argument("--router-host", default=ROUTER_ADDR[0])
+    parser.add_argument("--router-port", type=int, default=ROUTER_ADDR[1])
+    parser.add_argument("--sender-host", default=SENDER_ADDR[0], help="Endereco local onde os ACKs chegam")
+    parser.add_argument("--sender-port", type=int, default=SENDER_ADDR[1])
+    parser.add_argument("-q", "--quieto", action="store_true", help="Sem log por pacote")
+    parser.add_argument("--log-janela", type=str, default="", help="Grava a evolucao da janela em CSV (t,janela; com conn na frente se --conexoes > 1)")
+    args = parser.parse_args()
+    if max(args.janela_max, args.tamanho_janela) > JANELA_SERIAL_MAX:
+        parser.error(f"janela acima de {JANELA_SERIAL_MAX} tornaria os seqs de 16 bits ambiguos")
+    if not 1 <= args.payload <= MAX_PAYLOAD:
+        parser.error(f"--payload deve estar entre 1 e {MAX_PAYLOAD}")
+    if args.ack == "texto" and args.payload != MAX_DATA_SIZE:
+        parser.error(f"o formato texto termina no pacote curto: --payload precisa ser {MAX_DATA_SIZE}")
+    primeira = args.primeira_conexao if args.primeira_conexao is not None else 1
+    com_id = args.conexoes > 1 or args.primeira_conexao is not None
+    if args.conexoes < 1:
+        parser.error("--conexoes deve ser >= 1")
+    if primeira < 0 or primeira + args.conexoes - 1 > 0xFFFF:
+        parser.error("ids de conexao devem caber em 16 bits (0 a 65535)")
+    if com_id and args.ack == "texto":
+        parser.error("o formato texto nao tem id de conexao: use --ack binario")
+    if args.conexoes > 1 and args.arquivo == "-":
+        parser.error("stdin so pode ser lido uma vez: use um arquivo com --conexoes")
+    verboso = not args.quieto
+
+    def novo_controle():
+        if args.janela == "fixa":
+            return JanelaFixa(args.tamanho_janela, args.janela_max)
+        return CONTROLADORES[args.janela](maxima=args.janela_max)
 
-    texto = input("Digite a mensagem para enviar: ")
-    dados = texto.encode('utf-8')
+    emissor = GoBackNSender((args.sender_host, args.sender_port), (args.router_host, args.router_port))
+    print(f"[Emissor] Escutando ACKs em {emissor.local}")
 
-    emissor_ativo = True
-    threading.Thread(target=escutar_acks, args=(sock,), daemon=True).start()
+    if args.arquivo:
+        fontes = [abrir_fonte(args.arquivo) for _ in range(args.conexoes)]
+    else:
+        texto = input("Digite a mensagem para enviar: ").encode('utf-8')
+        fontes = [FonteLeitura(io.BytesIO(texto)) for _ in range(args.conexoes)]
 
-    data_ptr = 0
+    formato_v2 = args.ack == "binario"
+    transferencias = [
+        emissor.abrir(fonte, conn=primeira + i if com_id else None, controle=novo_controle(),
+                      payload=args.payload, modo_sr=args.modo == "sr", formato_v2=formato_v2,
+                      pedir_crc32=formato_v2 and args.checksum == "crc32")
+        for i, fonte in enumerate(fontes)]
+    emissor.iniciar()
+
+    inicio = time.monotonic()
     try:
-        while data_ptr < len(dados) or base < next_seq_num:
-            if next_seq_num < base + WINDOW_SIZE and data_ptr < len(dados):
-                with lock:
-                    bloco = dados[data_ptr:data_ptr + MAX_DATA_SIZE]
-                    data_ptr += len(bloco)
-                    pacote = criar_pacote(next_seq_num, bloco)
-                    buffer_pacotes[next_seq_num] = pacote
-                    sock.sendto(pacote, ROUTER_ADDR)
-                    print(f"[Emissor] Pacote {next_seq_num} enviado. (janela: {base} a {base+WINDOW_SIZE-1})")
-                    if base == next_seq_num:
-                        if timer: timer.cancel()
-                        timer = threading.Timer(TIMEOUT, evento_timeout, args=(sock,))
-                        timer.start()
-                    next_seq_num += 1
-            else:
-                time.sleep(0.01)
-        
-        print(f"\n[Emissor] Todos os dados enviados. data_ptr={data_ptr}, len(dados)={len(dados)}")
-
-        # Pacote final (FIN)
-        with lock:
-            pacote_fin = criar_pacote(next_seq_num, b'')
-            buffer_pacotes[next_seq_num] = pacote_fin
-            sock.sendto(pacote_fin, ROUTER_ADDR)
-            print(f"[Emissor] FIN (seq {next_seq_num}) enviado.")
-            if timer is None or base == next_seq_num:
-                if timer: timer.cancel()
-                timer = threading.Timer(TIMEOUT, evento_timeout, args=(sock,))
-                timer.start()
-                print("[Emissor] Timer iniciado para FIN")
-            next_seq_num += 1
-
-        print(f"[Emissor] Aguardando confirmação final. base={base}, next_seq_num={next_seq_num}")
-        while base < next_seq_num:
-            time.sleep(0.05)
-        print(f"[Emissor] Confirmação final recebida! base={base}, next_seq_num={next_seq_num}")
+        if len(transferencias) == 1:
+            transferencias[0].executar()
+            erros = {}
+        else:
+            erros = executar_todas(transferencias)
+        duracao = time.monotonic() - inicio
+        for t in transferencias:
+            if t.conn not in erros and (len(transferencias) == 1 or verboso):
+                for linha in t.resumo():
+                    print(linha)
+        if len(transferencias) > 1:
+            total = sum(t.enviados for t in transferencias)
+            print(f"[Emissor] {len(transferencias) - len(erros)}/{len(transferencias)} conexoes concluidas: "
+                  f"{total} bytes em {duracao:.2f} s ({total / duracao / 1e6:.2f} MB/s agregados), "
+                  f"{sum(t.pacotes_reenviados for t in transferencias)} pacotes reenviados")
+            for conn, e in sorted(erros.items()):
+                print(f"[Emissor #{conn}] Falhou: {e}")
+        if args.log_janela:
+            with open(args.log_janela, "w") as f:
+                if len(transferencias) == 1:
+                    t = transferencias[0]
+                    t0 = t.historico_janela[0][0]
+                    f.write("t,janela\n")
+                    f.writelines(f"{ti - t0:.6f},{j}\n" for ti, j in t.historico_janela)
+                else:
+                    f.write("conn,t,janela\n")
+                    for t in transferencias:
+                        f.writelines(f"{t.conn},{ti - inicio:.6f},{j}\n" for ti, j in t.historico_janela)
+        if erros:
+            sys.exit(1)
 
     finally:
-        if timer: timer.cancel()
-        emissor_ativo = False
-        sock.close()
+        emissor.fechar()
         print("\n[Emissor] Envio concluído e socket fechado.")
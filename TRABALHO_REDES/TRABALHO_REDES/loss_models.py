@@ -0,0 +1,132 @@
+"""Modelos de perda plugáveis para o roteador e fluxos de decisões pré-computados.
+
+As decisões aleatórias são geradas em blocos a partir de um gerador com semente
+(numpy, se instalado; senão random.Random), então o custo por pacote é um índice
+em lista e a mesma semente reproduz a mesma sequência de decisões.
+"""
+import bisect
+import itertools
+import json
+import random
+
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional: o fallback gera os blocos em Python puro
+    np = None
+
+BLOCK_SIZE = 4096
+
+
+class UniformStream:
+    """Sequência de uniformes em [0, 1) servida de blocos pré-gerados.
+
+    `next` é o __next__ de um iterador encadeado sobre os blocos (chamada em C, sem
+    aritmética de índice em Python); use-o direto no caminho quente.
+    """
+
+    def __init__(self, seed=None, block=BLOCK_SIZE):
+        if np is not None:
+            gen = np.random.default_rng(seed)
+            fill = lambda: gen.random(block).tolist()
+        else:
+            gen = random.Random(seed)
+            fill = lambda: [gen.random() for _ in range(block)]
+        self.next = itertools.chain.from_iterable(iter(fill, None)).__next__
+
+    def __call__(self):
+        return self.next()
+
+    def take(self, n):
+        """Próximos n uniformes de uma vez (para modelos que geram seus próprios blocos)."""
+        nxt = self.next
+        return [nxt() for _ in range(n)]
+
+
+class GilbertElliottLoss:
+    """Canal de dois estados (Bom/Ruim) com perdas em rajada.
+
+    p_gb: prob. de passar de Bom para Ruim por pacote; p_bg: de Ruim para Bom.
+    loss_good/loss_bad: prob. de perda em cada estado. As decisões de um bloco inteiro
+    são geradas de uma vez; por pacote resta só o índice.
+    """
+
+    def __init__(self, p_gb, p_bg, loss_good, loss_bad, stream, block=BLOCK_SIZE):
+        self.p_gb = p_gb
+        self.p_bg = p_bg
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.stream = stream
+        self.block_size = block
+        self.bad = False
+        self.decisions = []
+        self.i = 0
+
+    def _refill(self):
+        u = self.stream.take(2 * self.block_size)
+        out = []
+        bad = self.bad
+        p_gb, p_bg, lg, lb = self.p_gb, self.p_bg, self.loss_good, self.loss_bad
+        for k in range(0, len(u), 2):
+            bad = (u[k] >= p_bg) if bad else (u[k] < p_gb)
+            out.append(u[k + 1] < (lb if bad else lg))
+        self.bad = bad
+        self.decisions = out
+        self.i = 0
+
+    def lost(self, now):
+        if self.i >= len(self.decisions):
+            self._refill()
+        d = self.decisions[self.i]
+        self.i += 1
+        return d
+
+    def mean_loss(self):
+        """Taxa de perda estacionária esperada."""
+        pi_bad = self.p_gb / (self.p_gb + self.p_bg) if self.p_gb + self.p_bg else 0.0
+        return pi_bad * self.loss_bad + (1 - pi_bad) * self.loss_good
+
+    def describe(self):
+        return {"model": "gilbert", "p_gb": self.p_gb, "p_bg": self.p_bg,
+                "loss_good": self.loss_good, "loss_bad": self.loss_bad, "mean_loss": self.mean_loss()}
+
+
+class ProfileLoss:
+    """Probabilidade de perda variando no tempo: degraus (t, p) contados a partir do primeiro pacote."""
+
+    def __init__(self, points, stream, loop=False):
+        points = sorted(points)
+        self.times = [t for t, _ in points]
+        self.probs = [p for _, p in points]
+        self.stream = stream
+        self.loop = loop
+        self.t0 = None
+
+    def p_at(self, now):
+        if self.t0 is None:
+            self.t0 = now
+        elapsed = now - self.t0
+        if self.loop and self.times[-1] > 0:
+            elapsed %= self.times[-1]
+        i = bisect.bisect_right(self.times, elapsed) - 1
+        return self.probs[i] if i >= 0 else 0.0
+
+    def lost(self, now):
+        return self.stream.next() < self.p_at(now)
+
+    def describe(self):
+        return {"model": "profile", "points": list(zip(self.times, self.probs)), "loop": self.loop}
+
+
+def load_profile(path):
+    """Lê um perfil: JSON [[t, p], ...] ou texto com linhas 't p' (comentários com '#')."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return [(float(t), float(p)) for t, p in json.loads(text)]
+    points = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if line:
+            t, p = line.split()[:2]
+            points.append((float(t), float(p)))
+    return points
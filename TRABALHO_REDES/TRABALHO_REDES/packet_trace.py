@@ -0,0 +1,251 @@
+"""Trace binário do roteador: gravação fora do caminho quente, replay de decisões e resumo offline.
+
+Formato: cabeçalho MAGIC + versão + instante de início (epoch), seguido de registros
+RECORD de tamanho fixo. Registros DECISION guardam o que o roteador decidiu para cada
+pacote recebido (flags + atraso sorteado); registros TX marcam cada envio efetivo. Pacotes
+de dados levam também o tamanho da carga útil (sem cabeçalho v1/v2, extensão nem trailer).
+Todo registro traz a chave do fluxo: endereço IPv4:porta do emissor (origem dos dados,
+destino dos ACKs) e o id de conexão (NO_CONN quando o pacote não traz F_CONN/ACK_F_CONN).
+
+Uso offline:
+    python packet_trace.py summary trace.bin
+    python packet_trace.py dump trace.bin
+"""
+import argparse
+import json
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from functools import lru_cache
+
+from protocolo import tamanho_carga
+
+MAGIC = b"RTRC"
+VERSION = 3
+HEADER = struct.Struct("<4sBd")
+# t (s desde o início), direção, tipo, flags, seq, crc32 do datagrama, atraso/valor, tamanho,
+# carga útil (dados; 0 nos ACKs), IPv4 e porta do emissor, id de conexão
+RECORD = struct.Struct("<dBBBxIIfHH4sHI")
+
+DIRECTIONS = ('fwd', 'back')
+DIR_CODE = {d: i for i, d in enumerate(DIRECTIONS)}
+KIND_DECISION, KIND_TX, KIND_EXPIRED = 0, 1, 2
+KIND_NAMES = {KIND_DECISION: 'decision', KIND_TX: 'tx', KIND_EXPIRED: 'expired'}
+NO_SEQ = 0xFFFFFFFF
+NO_CONN = 0xFFFFFFFF
+NO_HOST = bytes(4)
+
+# flags de decisão
+F_DROP = 0x01
+F_CORRUPT = 0x02
+F_HOLD = 0x04
+F_RELEASE = 0x08  # liberou um pacote retido antes deste
+F_DUP = 0x10
+F_QUEUE_DROP = 0x20
+FLAG_NAMES = {F_DROP: 'drop', F_CORRUPT: 'corrupt', F_HOLD: 'hold', F_RELEASE: 'release',
+              F_DUP: 'dup', F_QUEUE_DROP: 'queue_drop'}
+
+
+def flag_names(flags):
+    return [name for bit, name in FLAG_NAMES.items() if flags & bit]
+
+
+@lru_cache(maxsize=1024)
+def _host_bytes(host):
+    try:
+        return socket.inet_aton(socket.gethostbyname(host))
+    except OSError:
+        return NO_HOST
+
+
+def flow_name(host, port, conn):
+    name = f"{socket.inet_ntoa(host)}:{port}"
+    return name if conn == NO_CONN else f"{name}#{conn}"
+
+
+class TraceWriter:
+    """Acumula registros em blocos pré-alocados; uma thread grava os blocos cheios no arquivo,
+    e a cada flush_interval segundos também o trecho ainda não gravado do bloco atual."""
+
+    def __init__(self, path, records_per_chunk=16384, flush_interval=1.0):
+        self.f = open(path, "wb")
+        self.t0 = time.monotonic()
+        self.f.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.f.flush()
+        self.chunk_size = records_per_chunk * RECORD.size
+        self.chunk = bytearray(self.chunk_size)
+        self.offset = 0
+        self.flushed = 0  # até onde o bloco atual já foi entregue à thread de gravação
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def write(self, direction, kind, flags, seq, data, value=0.0, sender=None, conn=None):
+        """sender: (host, porta) do emissor do fluxo; conn: id de conexão do pacote (ou None)."""
+        t = time.monotonic() - self.t0
+        digest = zlib.crc32(data)
+        payload = tamanho_carga(data) if direction == 'fwd' else 0
+        host, port = (NO_HOST, 0) if sender is None else (_host_bytes(sender[0]), sender[1])
+        with self.lock:
+            RECORD.pack_into(self.chunk, self.offset, t, DIR_CODE[direction], kind, flags,
+                             NO_SEQ if seq is None else seq & 0xFFFFFFFF, digest, value, min(len(data), 0xFFFF),
+                             min(payload, 0xFFFF), host, port, NO_CONN if conn is None else conn)
+            self.offset += RECORD.size
+            if self.offset == self.chunk_size:
+                self.pending.put(self.chunk if self.flushed == 0 else self.chunk[self.flushed:])
+                self.chunk = bytearray(self.chunk_size)
+                self.offset = self.flushed = 0
+
+    def _flush_partial(self):
+        # pela fila, com a trava: o trecho não passa à frente de um bloco cheio já enfileirado
+        with self.lock:
+            if self.offset > self.flushed:
+                self.pending.put(self.chunk[self.flushed:self.offset])
+                self.flushed = self.offset
+
+    def _drain(self):
+        while True:
+            try:
+                chunk = self.pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush_partial()
+                continue
+            if chunk is None:
+                break
+            self.f.write(chunk)
+            self.f.flush()
+
+    def close(self):
+        self._flush_partial()
+        self.pending.put(None)
+        self.thread.join()
+        self.f.close()
+
+
+def read_trace(path):
+    """Devolve (instante de início epoch, lista de registros como tuplas RECORD)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if len(raw) < HEADER.size:
+        raise ValueError(f"{path}: trace truncado ({len(raw)} bytes, sem cabecalho)")
+    magic, version, started = HEADER.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: trace invalido (magic={magic!r}, versao={version})")
+    body = memoryview(raw)[HEADER.size:]
+    usable = len(body) - len(body) % RECORD.size
+    return started, [r for r in RECORD.iter_unpack(body[:usable])]
+
+
+class ReplayDecisions:
+    """Decisões gravadas, por (direção, conexão, seq), na ordem em que ocorreram.
+
+    O fluxo é reconhecido pelo id de conexão, não pelo endereço: as portas efêmeras dos
+    emissores mudam de uma execução para outra. Fluxos sem id dividem a mesma chave.
+    """
+
+    def __init__(self, path):
+        self.by_key = defaultdict(deque)
+        _, records = read_trace(path)
+        for t, d, kind, flags, seq, _, value, _, _, _, _, conn in records:
+            if kind == KIND_DECISION and seq != NO_SEQ:
+                self.by_key[(DIRECTIONS[d], conn, seq)].append((flags, value))
+
+    def next(self, direction, seq, conn=None):
+        """Próxima decisão (flags, atraso) para este seq da conexão, ou None se o trace acabou para ele."""
+        q = self.by_key.get((direction, NO_CONN if conn is None else conn, seq))
+        return q.popleft() if q else None
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def summarize(path):
+    """Goodput, razão de retransmissão e latência por seq (primeira chegada -> primeiro ACK do
+    mesmo fluxo que o cobre); seqs de fluxos diferentes não se misturam."""
+    _, records = read_trace(path)
+    if not records:
+        return {"records": 0}
+    duration = records[-1][0] - records[0][0]
+    arrivals = defaultdict(int)
+    first_rx = defaultdict(dict)
+    delivered = {}
+    actions = defaultdict(int)
+    acks = defaultdict(list)
+    for t, d, kind, flags, seq, _, value, _, payload, host, port, conn in records:
+        direction = DIRECTIONS[d]
+        flow = (host, port, conn)
+        if kind == KIND_DECISION:
+            for name in flag_names(flags):
+                actions[f"{direction}_{name}"] += 1
+            if direction == 'fwd' and seq != NO_SEQ:
+                arrivals[(flow, seq)] += 1
+                first_rx[flow].setdefault(seq, t)
+        elif direction == 'fwd' and seq != NO_SEQ:
+            delivered.setdefault((flow, seq), payload)
+        elif direction == 'back' and seq != NO_SEQ:
+            acks[flow].append((t, seq))
+    latencies = []
+    for flow, rx in first_rx.items():
+        pending = sorted(rx.items())
+        i = 0
+        best = -1
+        for t, ack in acks.get(flow, ()):
+            if ack >= 0x80000000:  # ACK(-1) inicial
+                continue
+            best = max(best, ack)
+            while i < len(pending) and pending[i][0] <= best:
+                seq, t_rx = pending[i]
+                if t >= t_rx:
+                    latencies.append(t - t_rx)
+                i += 1
+    latencies.sort()
+    unique = len(arrivals)
+    total = sum(arrivals.values())
+    return {
+        "records": len(records),
+        "duration_s": duration,
+        "flows": sorted(flow_name(*flow) for flow in first_rx),
+        "unique_seqs": unique,
+        "fwd_arrivals": total,
+        "retransmission_ratio": (total - unique) / unique if unique else 0.0,
+        "goodput_Bps": sum(delivered.values()) / duration if duration > 0 else 0.0,
+        "actions": dict(sorted(actions.items())),
+        "latency_s": {"count": len(latencies),
+                      "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                      "p50": _percentile(latencies, 0.5), "p99": _percentile(latencies, 0.99),
+                      "max": latencies[-1] if latencies else 0.0},
+    }
+
+
+def dump(path, out=sys.stdout):
+    started, records = read_trace(path)
+    print(f"# inicio={started:.6f} registros={len(records)}", file=out)
+    for t, d, kind, flags, seq, digest, value, size, payload, host, port, conn in records:
+        seq_s = "-" if seq == NO_SEQ else str(seq)
+        extra = ",".join(flag_names(flags)) if kind == KIND_DECISION else ""
+        print(f"{t:12.6f} {DIRECTIONS[d]:4} {KIND_NAMES.get(kind, kind):8} {flow_name(host, port, conn):>22} seq={seq_s:>6} "
+              f"len={size:5} carga={payload:5} crc={digest:08x} delay={value:.6f} {extra}", file=out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ferramentas para traces do roteador")
+    parser.add_argument("cmd", choices=["summary", "dump"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+    try:
+        if args.cmd == "summary":
+            print(json.dumps(summarize(args.path), indent=2))
+        else:
+            dump(args.path)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
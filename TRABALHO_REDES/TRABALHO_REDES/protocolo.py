@@ -0,0 +1,169 @@
+"""Formatos de pacote compartilhados por emissor, roteador e ferramentas.
+
+Dados v1 (legado):  seq(H) checksum(H) dados
+Dados v2:           0xA7 flags(B) checksum(H) seq(H) ts(I) dados
+    ts: relógio do emissor em microssegundos (mod 2^32), ecoado no ACK para medir RTT.
+    checksum: soma de complemento de um do datagrama inteiro com o campo zerado;
+    com a flag F_CRC32 o campo vai zerado e um CRC32 de todo o resto segue os dados (4 bytes).
+    F_FIN marca o último pacote (vazio); no v1 o fim é o primeiro pacote com menos de 50 bytes.
+    F_CONN: conn(H) logo após o cabeçalho identifica a transferência quando várias dividem
+    o mesmo socket do emissor; cada conn tem seus próprios seqs, janela e FIN.
+
+ACK texto (legado): {'ack_num':N,'sack':[[a,b],...]}
+ACK binário:        0xAC flags(B) n_sack(B) pad ack(I) ts_eco(I) rwnd(H) + n_sack x [inicio(I) fim(I)]
+    ack = 0xFFFFFFFF representa ACK(-1); ts_eco = 0 significa sem eco (ex.: pacote corrompido);
+    rwnd = seqs que o receptor ainda aceita fora de ordem; blocos SACK inclusivos.
+    flags: ACK_F_CRC32 = o receptor aceita pacotes com F_CRC32 (negociação);
+           ACK_F_CONN = conn(H) do pacote reconhecido vem logo após o cabeçalho, antes dos blocos.
+
+O receptor responde no formato dos dados que recebeu: v1 -> ACK texto, v2 -> ACK binário.
+
+Seqs: emissor e receptor contam sem limite; no fio vão os 16 bits de baixo (dados) ou
+32 bits (ACK binário), e cada lado reconstrói o valor com aritmética serial (RFC 1982)
+em torno da sua posição na janela. Vale enquanto a janela for menor que 2^15 pacotes.
+Um v1 com seq 0xA7xx só seria confundido com v2 se o checksum v2 também batesse.
+"""
+import json
+import struct
+import time
+
+MAGIC_DADOS = 0xA7
+MAGIC_ACK = 0xAC
+
+# flags do cabeçalho v2
+F_CRC32 = 0x01
+F_FIN = 0x02  # último pacote (vazio): fim do fluxo, qualquer que seja o tamanho dos dados
+F_CONN = 0x04  # cabeçalho estendido com o id da conexão
+# flags do ACK binário
+ACK_F_CRC32 = 0x01
+ACK_F_CONN = 0x02
+
+CABECALHO_V1 = struct.Struct("!HH")
+SEQ_V1 = struct.Struct("!H")
+TRAILER_CRC32 = struct.Struct("!I")
+CABECALHO_V2 = struct.Struct("!BBHHI")
+CONN = struct.Struct("!H")
+ACK = struct.Struct("!BBBxIIH")
+BLOCO_SACK = struct.Struct("!II")
+MAX_SACK_BLOCOS = 4
+ACK_MENOS_UM = 0xFFFFFFFF
+
+
+JANELA_SERIAL_MAX = (1 << 15) - 1  # maior janela em que seqs de 16 bits não ficam ambíguos
+
+
+def desembrulhar(valor, referencia, bits=16):
+    """Inteiro congruente a valor (mod 2^bits) mais próximo de referencia (RFC 1982)."""
+    m = 1 << bits
+    d = (valor - referencia) % m
+    if d >= m >> 1:
+        d -= m
+    return referencia + d
+
+
+def agora_us():
+    """Carimbo de tempo do cabeçalho v2 (µs, mod 2^32)."""
+    return int(time.monotonic() * 1e6) & 0xFFFFFFFF
+
+
+def rtt_de_eco(ts_eco):
+    """RTT em segundos a partir do ts ecoado (diferença segura na volta dos 32 bits)."""
+    return ((agora_us() - ts_eco) & 0xFFFFFFFF) / 1e6
+
+
+def eh_v2(dados):
+    return len(dados) >= CABECALHO_V2.size and dados[0] == MAGIC_DADOS
+
+
+def tamanho_cabecalho(dados):
+    if not eh_v2(dados):
+        return CABECALHO_V1.size
+    return CABECALHO_V2.size + CONN.size if dados[1] & F_CONN else CABECALHO_V2.size
+
+
+def conn_do_pacote(dados):
+    """Id da conexão de um pacote de dados v2 com F_CONN; None nos demais."""
+    if eh_v2(dados) and dados[1] & F_CONN and len(dados) >= CABECALHO_V2.size + CONN.size:
+        return CONN.unpack_from(dados, CABECALHO_V2.size)[0]
+    return None
+
+
+def seq_do_pacote(dados):
+    """Seq (16 bits, como no fio) de um pacote de dados v1 ou v2; None se curto demais."""
+    if eh_v2(dados):
+        return CABECALHO_V2.unpack_from(dados)[3]
+    if len(dados) >= 2:
+        return CABECALHO_V1.unpack_from(dados)[0]
+    return None
+
+
+def tamanho_carga(pacote):
+    """Tamanho dos dados de um pacote v1/v2, sem cabeçalho nem trailer CRC32."""
+    n = len(pacote) - tamanho_cabecalho(pacote)
+    if eh_v2(pacote) and pacote[1] & F_CRC32:
+        n -= TRAILER_CRC32.size
+    return max(0, n)
+
+
+def carga_util(pacote):
+    """Dados de um pacote v1/v2, sem cabeçalho nem trailer CRC32."""
+    if eh_v2(pacote):
+        fim = len(pacote) - TRAILER_CRC32.size if pacote[1] & F_CRC32 else len(pacote)
+        return pacote[tamanho_cabecalho(pacote):fim]
+    return pacote[CABECALHO_V1.size:]
+
+
+def montar_ack(ack, ts_eco=0, rwnd=0xFFFF, sack=(), flags=0, conn=None):
+    """ACK binário; sack é uma sequência de pares (inicio, fim) inclusivos."""
+    sack = sack[:MAX_SACK_BLOCOS]
+    inicio = ACK.size if conn is None else ACK.size + CONN.size
+    if conn is not None:
+        flags |= ACK_F_CONN
+    out = bytearray(inicio + BLOCO_SACK.size * len(sack))
+    ACK.pack_into(out, 0, MAGIC_ACK, flags, len(sack), ack & 0xFFFFFFFF, ts_eco, rwnd)
+    if conn is not None:
+        CONN.pack_into(out, ACK.size, conn)
+    for i, (a, b) in enumerate(sack):
+        BLOCO_SACK.pack_into(out, inicio + i * BLOCO_SACK.size, a, b)
+    return bytes(out)
+
+
+def ler_ack(dados):
+    """(ack, sack, ts_eco, rwnd, flags, conn) de um ACK binário ou texto; None se não reconhecer.
+
+    No texto não há ts_eco nem rwnd (None) e flags é 0; sack é None quando o receptor não o anuncia;
+    conn é None sem ACK_F_CONN.
+    """
+    if len(dados) >= ACK.size and dados[0] == MAGIC_ACK:
+        _, flags, n, ack, ts_eco, rwnd = ACK.unpack_from(dados)
+        if ack == ACK_MENOS_UM:
+            ack = -1
+        conn = None
+        inicio = ACK.size
+        if flags & ACK_F_CONN:
+            if len(dados) < ACK.size + CONN.size:
+                return None
+            conn = CONN.unpack_from(dados, ACK.size)[0]
+            inicio += CONN.size
+        sack = [BLOCO_SACK.unpack_from(dados, inicio + i * BLOCO_SACK.size)
+                for i in range(min(n, (len(dados) - inicio) // BLOCO_SACK.size))]
+        return ack, sack, ts_eco, rwnd, flags, conn
+    try:
+        msg = json.loads(dados.decode('utf-8', errors='ignore').replace("'", '"').strip())
+        ack = msg.get("ack_num")
+    except (ValueError, AttributeError):
+        return None
+    if ack is None:
+        return None
+    return ack, msg.get("sack"), None, None, 0, None
+
+
+def descrever_ack(dados):
+    """Texto curto de um ACK para logs."""
+    if dados[:1] == bytes([MAGIC_ACK]):
+        r = ler_ack(dados)
+        if r is not None:
+            ack, sack, ts_eco, rwnd, _, conn = r
+            prefixo = "" if conn is None else f"conn={conn} "
+            return f"{prefixo}ACK({ack}) sack={sack} rwnd={rwnd} ts_eco={ts_eco}"
+    return dados.decode(errors='ignore')
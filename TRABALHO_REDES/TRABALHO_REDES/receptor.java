@@ -3,6 +3,9 @@ import java.net.*;
 import java.nio.*;
 import java.nio.charset.StandardCharsets;
 import java.util.Arrays;
+import java.util.HashMap;
+import java.util.TreeMap;
+import java.util.zip.CRC32;
 
 public class Receptor {
 
@@ -10,20 +13,83 @@ public class Receptor {
     private static final int PORTA_EMISSOR = 9003;
     private static final String IP = "127.0.0.1";
     private static final int MAX_DATA_SIZE = 50;
+    private static final int JANELA_RECEPCAO = 1024; // seqs aceitos fora de ordem à frente de expectedSeq
+    private static final int MAX_SACK_BLOCOS = 4;
+    // Cabeçalho v2 (ver protocolo.py): 0xA7 flags checksum(2) seq(2) ts(4); respondido com ACK binário
+    private static final int MAGIC_DADOS = 0xA7;
+    private static final int CABECALHO_V2 = 10;
+    private static final int F_CRC32 = 0x01;      // flag v2: campo checksum zerado + CRC32 de 4 bytes no fim
+    private static final int F_FIN = 0x02;        // flag v2: último pacote do fluxo
+    private static final int F_CONN = 0x04;       // flag v2: id da conexão (2 bytes) após o cabeçalho
+    private static final int CONN_TAMANHO = 2;
+    private static final int TRAILER_CRC32 = 4;
+    private static final int ACK_F_CRC32 = 0x01;  // flag do ACK: este receptor aceita F_CRC32
+    private static final int ACK_F_CONN = 0x02;   // flag do ACK: id da conexão após o cabeçalho
+    private static final int MAGIC_ACK = 0xAC;
+    private static final int ACK_TAMANHO = 14;
+    private static final int ESPERA_FIN_MS = 2000; // silêncio após o FIN antes de fechar
+    private static boolean verboso = true;
 
+    private static void log(String msg) {
+        if (verboso) System.out.println(msg);
+    }
+
+    // Estado de uma conexão: cada id (F_CONN) tem seus seqs, buffer fora de ordem, FIN e saída.
+    // A conexão sem id (null) é a transferência única de sempre.
+    private static class Conexao {
+        final Integer id;
+        int expectedSeq = 0;
+        int seqFin = -1; // seq do FIN (v2) ou do primeiro pacote curto (v1), quando conhecido
+        long recebidos = 0;
+        final TreeMap<Integer, byte[]> foraDeOrdem = new TreeMap<>();
+        boolean ackBinario = false; // formato da resposta: o do último pacote recebido
+        boolean concluida = false;
+        final String arquivo;
+        final ByteArrayOutputStream mensagem = new ByteArrayOutputStream();
+        final OutputStream saida;
+
+        Conexao(Integer id, String arquivoSaida) throws IOException {
+            this.id = id;
+            this.arquivo = arquivoSaida == null ? null : (id == null ? arquivoSaida : arquivoSaida + "." + id);
+            this.saida = arquivo == null ? mensagem : new BufferedOutputStream(new FileOutputStream(arquivo), 1 << 16);
+        }
+
+        String nome() {
+            return id == null ? "[Receptor]" : "[Receptor #" + id + "]";
+        }
+    }
+
+    // Uso: java Receptor [-q] [arquivo_saida]
+    // Com arquivo, os dados vão sendo gravados conforme chegam em ordem (memória constante);
+    // com várias conexões, cada uma grava em arquivo_saida.<id>.
     public static void main(String[] args) {
         DatagramSocket socket = null;
-        ByteArrayOutputStream mensagem = new ByteArrayOutputStream();
-        int expectedSeq = 0;
+        String arquivoSaida = null;
+        for (String a : args) {
+            if (a.equals("-q")) verboso = false;
+            else arquivoSaida = a;
+        }
+        HashMap<Integer, Conexao> conexoes = new HashMap<>();
+        int concluidas = 0;
 
         try {
             socket = new DatagramSocket(PORTA_RECEPTOR);
             System.out.println("[Receptor] Aguardando pacotes em " + IP + ":" + PORTA_RECEPTOR + "...");
 
-            byte[] buffer = new byte[1024];
+            byte[] buffer = new byte[65535];
             while (true) {
+                // Todas as conexões concluídas: o ACK do FIN pode se perder no roteador, então
+                // continua reconfirmando o que chegar até ESPERA_FIN_MS sem tráfego, senão o
+                // emissor retransmitiria para sempre. Uma conexão nova no meio volta a esperar.
+                boolean todasConcluidas = !conexoes.isEmpty() && concluidas == conexoes.size();
+                socket.setSoTimeout(todasConcluidas ? ESPERA_FIN_MS : 0);
                 DatagramPacket pacote = new DatagramPacket(buffer, buffer.length);
-                socket.receive(pacote);
+                try {
+                    socket.receive(pacote);
+                } catch (SocketTimeoutException e) {
+                    log("[Receptor] Emissor em silêncio: encerrando.");
+                    break;
+                }
                 byte[] dados = Arrays.copyOf(pacote.getData(), pacote.getLength());
 
                 if (dados.length < 4) {
@@ -34,71 +100,197 @@ public class Receptor {
                 ByteBuffer bb = ByteBuffer.wrap(dados);
                 bb.order(ByteOrder.BIG_ENDIAN);
 
-                int seqNum = bb.getShort() & 0xFFFF;
-                int checksumRecebido = bb.getShort() & 0xFFFF;
-                byte[] conteudo = Arrays.copyOfRange(dados, 4, dados.length);
+                Conexao c;
+                int seqNum;
+                int ts = 0;
+                byte[] conteudo;
+                boolean pareceV2 = dados.length >= CABECALHO_V2 && (dados[0] & 0xFF) == MAGIC_DADOS;
+                if (pareceV2 && integridadeV2Ok(dados)) {
+                    int cabecalho = CABECALHO_V2;
+                    Integer id = null;
+                    if ((dados[1] & F_CONN) != 0) {
+                        if (dados.length < CABECALHO_V2 + CONN_TAMANHO) continue;
+                        id = bb.getShort(CABECALHO_V2) & 0xFFFF;
+                        cabecalho += CONN_TAMANHO;
+                    }
+                    c = conexoes.get(id);
+                    if (c == null) {
+                        c = new Conexao(id, arquivoSaida);
+                        conexoes.put(id, c);
+                        if (id != null) log("[Receptor] Nova conexão " + id);
+                    }
+                    c.ackBinario = true;
+                    seqNum = desembrulhar(bb.getShort(4) & 0xFFFF, c.expectedSeq);
+                    ts = bb.getInt(6);
+                    int fimDados = (dados[1] & F_CRC32) != 0 ? dados.length - TRAILER_CRC32 : dados.length;
+                    conteudo = Arrays.copyOfRange(dados, cabecalho, fimDados);
+                    if ((dados[1] & F_FIN) != 0) c.seqFin = seqNum;
+                } else {
+                    // v1 e v2 corrompido: sem id confiável, só a conexão sem id responde
+                    c = conexoes.get(null);
+                    if (c == null) {
+                        if (!conexoes.isEmpty()) continue;
+                        c = new Conexao(null, arquivoSaida);
+                        conexoes.put(null, c);
+                    }
+                    seqNum = desembrulhar(bb.getShort() & 0xFFFF, c.expectedSeq);
+                    int checksumRecebido = bb.getShort() & 0xFFFF;
+                    conteudo = Arrays.copyOfRange(dados, 4, dados.length);
 
-                byte[] checksumData = new byte[2 + conteudo.length];
-                checksumData[0] = (byte) ((seqNum >> 8) & 0xFF);
-                checksumData[1] = (byte) (seqNum & 0xFF);
-                System.arraycopy(conteudo, 0, checksumData, 2, conteudo.length);
-                int checksumCalculado = calcularChecksum(checksumData);
+                    byte[] checksumData = new byte[2 + conteudo.length];
+                    checksumData[0] = (byte) ((seqNum >> 8) & 0xFF);
+                    checksumData[1] = (byte) (seqNum & 0xFF);
+                    System.arraycopy(conteudo, 0, checksumData, 2, conteudo.length);
+                    int checksumCalculado = calcularChecksum(checksumData);
 
-                if (checksumRecebido != checksumCalculado) {
-                    System.out.println("[Receptor] Pacote corrompido! Ignorando... (esperava seq=" + expectedSeq + ")");
-                    enviarAck(socket, expectedSeq - 1);
-                    continue;
+                    if (checksumRecebido != checksumCalculado) {
+                        // v2 com dados corrompidos mantém o magic: responde em binário
+                        c.ackBinario = pareceV2;
+                        log("[Receptor] Pacote corrompido! Ignorando... (esperava seq=" + c.expectedSeq + ")");
+                        enviarAck(socket, c, 0);
+                        continue;
+                    }
+                    c.ackBinario = false;
+                    if (conteudo.length < MAX_DATA_SIZE && (c.seqFin < 0 || seqNum < c.seqFin)) c.seqFin = seqNum;
                 }
 
-                if (seqNum == expectedSeq) {
-                    mensagem.write(conteudo);
-                    System.out.println("[Receptor] Pacote " + seqNum + " ACEITO! (novo expectedSeq=" + (expectedSeq+1) + ")");
-                    expectedSeq++;
+                boolean fim = false;
+                if (c.concluida) {
+                    log(c.nome() + " Conexão já concluída: reconfirmando (recebido=" + seqNum + ")");
+                } else if (seqNum == c.expectedSeq) {
+                    c.saida.write(conteudo);
+                    c.recebidos += conteudo.length;
+                    log(c.nome() + " Pacote " + seqNum + " ACEITO! (novo expectedSeq=" + (c.expectedSeq+1) + ")");
+                    fim = c.expectedSeq == c.seqFin;
+                    c.expectedSeq++;
+                    // entrega o que já estava guardado e agora ficou em ordem
+                    byte[] guardado;
+                    while (!fim && (guardado = c.foraDeOrdem.remove(c.expectedSeq)) != null) {
+                        c.saida.write(guardado);
+                        c.recebidos += guardado.length;
+                        log(c.nome() + " Pacote " + c.expectedSeq + " entregue do buffer.");
+                        fim = c.expectedSeq == c.seqFin;
+                        c.expectedSeq++;
+                    }
+                } else if (seqNum > c.expectedSeq && seqNum < c.expectedSeq + JANELA_RECEPCAO) {
+                    c.foraDeOrdem.putIfAbsent(seqNum, conteudo);
+                    log(c.nome() + " Fora de ordem, guardado (esperado=" + c.expectedSeq + ", recebido=" + seqNum + ")");
                 } else {
-                    System.out.println("[Receptor] Fora de ordem (esperado=" + expectedSeq + ", recebido=" + seqNum + ")");
+                    log(c.nome() + " Duplicado/fora da janela (esperado=" + c.expectedSeq + ", recebido=" + seqNum + ")");
                 }
 
-                enviarAck(socket, expectedSeq - 1);
+                enviarAck(socket, c, ts);
 
-                if (conteudo.length < MAX_DATA_SIZE) {
-                    System.out.println("\n[Receptor] Fim da transmissão detectado.");
-                    break;
+                // fim só quando o FIN é entregue em ordem (um FIN adiantado não encerra)
+                if (fim) {
+                    c.concluida = true;
+                    concluidas++;
+                    c.foraDeOrdem.clear();
+                    c.saida.close();
+                    System.out.println("\n" + c.nome() + " Fim da transmissão detectado.");
+                    if (c.arquivo != null) {
+                        System.out.println(c.nome() + " " + c.recebidos + " bytes gravados em " + c.arquivo);
+                    } else {
+                        System.out.println("\n===== MENSAGEM COMPLETA =====");
+                        System.out.println(new String(c.mensagem.toByteArray(), StandardCharsets.UTF_8));
+                        System.out.println("=============================");
+                    }
                 }
             }
-
-            System.out.println("\n===== MENSAGEM COMPLETA =====");
-            System.out.println(new String(mensagem.toByteArray(), StandardCharsets.UTF_8));
-            System.out.println("=============================");
+            if (conexoes.size() > 1)
+                System.out.println("[Receptor] " + concluidas + "/" + conexoes.size() + " conexões concluídas.");
 
         } catch (Exception e) {
             e.printStackTrace();
         } finally {
             if (socket != null) socket.close();
+            for (Conexao c : conexoes.values()) {
+                try { c.saida.close(); } catch (IOException e) { e.printStackTrace(); }
+            }
             System.out.println("[Receptor] Socket fechado.");
         }
     }
 
-    private static int calcularChecksum(byte[] dados) {
-        if (dados.length % 2 != 0)
-            dados = Arrays.copyOf(dados, dados.length + 1);
+    // Seq de 16 bits do fio -> contagem contínua mais próxima de referencia (aritmética serial,
+    // RFC 1982). Sem ambiguidade enquanto a janela do emissor ficar abaixo de 2^15 pacotes.
+    private static int desembrulhar(int seq16, int referencia) {
+        return referencia + (short) (seq16 - referencia);
+    }
 
-        int soma = 0;
-        for (int i = 0; i < dados.length; i += 2) {
-            int palavra = ((dados[i] & 0xFF) << 8) | (dados[i + 1] & 0xFF);
-            soma += palavra;
+    // Soma em long e dobra só no fim (sem copiar o array para completar tamanho ímpar)
+    private static int calcularChecksum(byte[] dados) {
+        long soma = 0;
+        int par = dados.length & ~1;
+        for (int i = 0; i < par; i += 2)
+            soma += ((dados[i] & 0xFF) << 8) | (dados[i + 1] & 0xFF);
+        if (par < dados.length)
+            soma += (dados[par] & 0xFF) << 8;
+        while ((soma >> 16) != 0)
             soma = (soma & 0xFFFF) + (soma >> 16);
+        return (int) (~soma) & 0xFFFF;
+    }
+
+    // v2: com F_CRC32, CRC32 de tudo menos o trailer; senão a soma de complemento de um do
+    // datagrama inteiro, campo de checksum incluído, tem de dar 0xFFFF (checksum calculado = 0)
+    private static boolean integridadeV2Ok(byte[] dados) {
+        if ((dados[1] & F_CRC32) != 0) {
+            if (dados.length < CABECALHO_V2 + TRAILER_CRC32) return false;
+            CRC32 crc = new CRC32();
+            crc.update(dados, 0, dados.length - TRAILER_CRC32);
+            long recebido = ByteBuffer.wrap(dados, dados.length - TRAILER_CRC32, TRAILER_CRC32).getInt() & 0xFFFFFFFFL;
+            return crc.getValue() == recebido;
         }
-        return (~soma) & 0xFFFF;
+        return calcularChecksum(dados) == 0;
     }
 
-    private static void enviarAck(DatagramSocket socket, int ackNum) throws IOException {
-        String ackMsg = "{'ack_num':" + ackNum + "}";
-        byte[] ackBytes = ackMsg.getBytes();
+    // Blocos [inicio,fim] (inclusivos) do buffer fora de ordem, no máximo MAX_SACK_BLOCOS.
+    private static int[][] blocosSack(TreeMap<Integer, byte[]> foraDeOrdem) {
+        int[][] blocos = new int[MAX_SACK_BLOCOS][];
+        int n = 0, inicio = -1, anterior = -1;
+        for (int seq : foraDeOrdem.keySet()) {
+            if (inicio >= 0 && seq == anterior + 1) {
+                anterior = seq;
+                continue;
+            }
+            if (inicio >= 0) {
+                blocos[n++] = new int[] {inicio, anterior};
+                if (n == MAX_SACK_BLOCOS) return blocos;
+            }
+            inicio = anterior = seq;
+        }
+        if (inicio >= 0) blocos[n++] = new int[] {inicio, anterior};
+        return Arrays.copyOf(blocos, n);
+    }
+
+    // ACK cumulativo + SACK. Texto: {'ack_num':N,'sack':[[a,b],...]} - a chave 'sack' vai sempre
+    // (mesmo vazia): é assim que o emissor sabe que pode usar Selective Repeat; um emissor
+    // Go-Back-N simplesmente a ignora. Binário (resposta a pacotes v2): magic, flags, n_sack, pad,
+    // ack, ts ecoado, janela livre[, id da conexão], blocos - ver protocolo.py.
+    private static void enviarAck(DatagramSocket socket, Conexao c, int tsEco) throws IOException {
+        int ackNum = c.expectedSeq - 1;
+        boolean binario = c.ackBinario;
+        int[][] sack = blocosSack(c.foraDeOrdem);
+        byte[] ackBytes;
+        if (binario) {
+            int extensao = c.id == null ? 0 : CONN_TAMANHO;
+            ByteBuffer bb = ByteBuffer.allocate(ACK_TAMANHO + extensao + 8 * sack.length).order(ByteOrder.BIG_ENDIAN);
+            int flags = c.id == null ? ACK_F_CRC32 : ACK_F_CRC32 | ACK_F_CONN;
+            bb.put((byte) MAGIC_ACK).put((byte) flags).put((byte) sack.length).put((byte) 0);
+            bb.putInt(ackNum).putInt(tsEco).putShort((short) Math.max(0, JANELA_RECEPCAO - c.foraDeOrdem.size()));
+            if (c.id != null) bb.putShort((short) (int) c.id);
+            for (int[] b : sack) bb.putInt(b[0]).putInt(b[1]);
+            ackBytes = bb.array();
+        } else {
+            StringBuilder txt = new StringBuilder("{'ack_num':").append(ackNum).append(",'sack':[");
+            for (int i = 0; i < sack.length; i++)
+                txt.append(i > 0 ? "," : "").append("[").append(sack[i][0]).append(",").append(sack[i][1]).append("]");
+            ackBytes = txt.append("]}").toString().getBytes();
+        }
         DatagramPacket ackPacket = new DatagramPacket(
                 ackBytes, ackBytes.length,
                 InetAddress.getByName(IP), PORTA_EMISSOR
         );
         socket.send(ackPacket);
-        System.out.println("[Receptor] Enviou ACK(" + ackNum + ")");
+        log(c.nome() + " Enviou ACK(" + ackNum + ")" + (binario ? " binario" : ""));
     }
 }
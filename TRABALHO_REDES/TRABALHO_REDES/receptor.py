@@ -0,0 +1,297 @@
+"""Receptor em Python com o mesmo comportamento do receptor.java, no fio e nos ACKs.
+
+Janela de recepção de JANELA_RECEPCAO seqs fora de ordem, SACK com até MAX_SACK_BLOCOS blocos,
+ACK texto para pacotes v1 e binário para v2 (com ACK_F_CRC32 e, por conexão, ACK_F_CONN), fim
+pela flag F_FIN (v2) ou pelo primeiro pacote curto (v1) e ESPERA_FIN de silêncio antes de
+fechar. Roda o sistema sem JDK e é o receptor em processo do benchmark.py.
+
+Uso: python receptor.py [-q] [arquivo_saida]
+"""
+import argparse
+import bisect
+import io
+import socket
+import zlib
+
+from checksum import crc32, internet
+from protocolo import (ACK_F_CRC32, CABECALHO_V1, CABECALHO_V2, F_CONN, F_CRC32, F_FIN, MAGIC_DADOS, MAX_SACK_BLOCOS,
+                       SEQ_V1, TRAILER_CRC32, conn_do_pacote, desembrulhar, montar_ack, tamanho_cabecalho)
+
+# --- CONFIGURAÇÕES ---
+RECEPTOR_ADDR = ('127.0.0.1', 9002)
+ACK_ADDR = ('127.0.0.1', 9003)   # porta de ACKs do roteador
+MAX_DATA_SIZE = 50 #v1: o primeiro pacote com menos dados que isso é o último
+JANELA_RECEPCAO = 1024 #seqs aceitos fora de ordem à frente de expected_seq
+ESPERA_FIN = 2.0 #silêncio (s) após o último FIN antes de fechar
+
+verboso = True #log por pacote (-q desliga)
+
+def info(msg):
+    if verboso:
+        print(msg)
+
+
+def integridade_v2_ok(dados):
+    """F_CRC32: CRC32 de tudo menos o trailer; senão a soma do datagrama inteiro (campo incluído) confere."""
+    if dados[1] & F_CRC32:
+        fim = len(dados) - TRAILER_CRC32.size
+        return fim >= CABECALHO_V2.size and crc32(dados[:fim]) == TRAILER_CRC32.unpack_from(dados, fim)[0]
+    return internet(dados) == 0
+
+
+# --- CONEXÃO ---
+class Conexao:
+    """Estado de um id de conexão (F_CONN): seqs, buffer fora de ordem, FIN e saída.
+
+    A conexão sem id (None) é a transferência única de sempre. Sem arquivo, os dados ficam em
+    memória (guardar=True, para imprimir a mensagem) ou são só contados; crc acumula o CRC32
+    do que foi entregue em ordem, para conferir a transferência sem guardar nada.
+    """
+
+    def __init__(self, id, arquivo_saida=None, guardar=True):
+        self.id = id
+        self.nome = "[Receptor]" if id is None else f"[Receptor #{id}]"
+        self.expected_seq = 0
+        self.seq_fin = -1 #seq do FIN (v2) ou do primeiro pacote curto (v1), quando conhecido
+        self.recebidos = 0 #bytes entregues em ordem
+        self.crc = 0
+        self.fora_de_ordem = {} #seq -> dados (memoryview do datagrama)
+        self.chaves = [] #seqs de fora_de_ordem em ordem crescente (entrega e blocos SACK)
+        self.ack_binario = False #formato da resposta: o do último pacote recebido
+        self.concluida = False
+        self.arquivo = None if arquivo_saida is None else (arquivo_saida if id is None else f"{arquivo_saida}.{id}")
+        self.mensagem = io.BytesIO() if self.arquivo is None and guardar else None
+        self.saida = open(self.arquivo, "wb", buffering=1 << 16) if self.arquivo else self.mensagem
+
+    def entregar(self, dados):
+        if self.saida is not None:
+            self.saida.write(dados)
+        self.recebidos += len(dados)
+        self.crc = zlib.crc32(dados, self.crc)
+
+    def blocos_sack(self):
+        """Blocos [inicio, fim] (inclusivos) do buffer fora de ordem, no máximo MAX_SACK_BLOCOS."""
+        blocos = []
+        for seq in self.chaves:
+            if blocos and seq == blocos[-1][1] + 1:
+                blocos[-1][1] = seq
+            elif len(blocos) == MAX_SACK_BLOCOS:
+                break
+            else:
+                blocos.append([seq, seq])
+        return blocos
+
+    def fechar(self):
+        if self.arquivo and self.saida is not None:
+            self.saida.close()
+
+
+# --- RECEPTOR ---
+class Receptor:
+    """Socket do receptor e as conexões vistas nele.
+
+    executar() recebe até todas as conexões concluírem e o emissor ficar espera_fin segundos
+    em silêncio (None = só para com parar()). Com anunciar, imprime o fim de cada conexão
+    como o receptor Java.
+    """
+
+    def __init__(self, local=RECEPTOR_ADDR, destino=ACK_ADDR, arquivo_saida=None, guardar=True,
+                 espera_fin=ESPERA_FIN, anunciar=True):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(local)
+        self.local = self.sock.getsockname()
+        self.destino = destino
+        self.arquivo_saida = arquivo_saida
+        self.guardar = guardar
+        self.espera_fin = espera_fin
+        self.anunciar = anunciar
+        self.conexoes = {} #id -> Conexao
+        self.concluidas = 0
+        self.ativo = False
+        self.em_execucao = False #executar() rodando: é ele quem fecha o socket
+        self.pacotes = 0 #datagramas recebidos
+        self.corrompidos = 0 #falharam no checksum/CRC32
+        self.duplicados = 0 #já entregues, já guardados ou fora da janela
+
+    def _conexao(self, id):
+        c = self.conexoes.get(id)
+        if c is None:
+            c = self.conexoes[id] = Conexao(id, self.arquivo_saida, self.guardar)
+            if id is not None:
+                info(f"[Receptor] Nova conexão {id}")
+        return c
+
+    def processar(self, dados):
+        """Trata um datagrama e responde com o ACK; devolve a conexão se ele a concluiu."""
+        self.pacotes += 1
+        if len(dados) < CABECALHO_V1.size:
+            print("[Receptor] Pacote muito pequeno! Ignorando...")
+            return None
+        dados = memoryview(dados)
+        parece_v2 = len(dados) >= CABECALHO_V2.size and dados[0] == MAGIC_DADOS
+        ts = 0
+        if parece_v2 and integridade_v2_ok(dados):
+            _, flags, _, seq16, ts = CABECALHO_V2.unpack_from(dados)
+            conn = conn_do_pacote(dados)
+            if flags & F_CONN and conn is None:
+                return None  # cabeçalho estendido truncado
+            c = self._conexao(conn)
+            c.ack_binario = True
+            seq = desembrulhar(seq16, c.expected_seq)
+            fim_dados = len(dados) - TRAILER_CRC32.size if flags & F_CRC32 else len(dados)
+            conteudo = dados[tamanho_cabecalho(dados):fim_dados]
+            if flags & F_FIN:
+                c.seq_fin = seq
+        else:
+            # v1 e v2 corrompido: sem id confiável, só a conexão sem id responde
+            if parece_v2:
+                self.corrompidos += 1
+            c = self.conexoes.get(None)
+            if c is None:
+                if self.conexoes:
+                    return None
+                c = self._conexao(None)
+            seq16, checksum_recebido = CABECALHO_V1.unpack_from(dados)
+            seq = desembrulhar(seq16, c.expected_seq)
+            conteudo = dados[CABECALHO_V1.size:]
+            if checksum_recebido != internet(SEQ_V1.pack(seq16), conteudo):
+                if not parece_v2:
+                    self.corrompidos += 1
+                # v2 com dados corrompidos mantém o magic: responde em binário
+                c.ack_binario = parece_v2
+                info(f"[Receptor] Pacote corrompido! Ignorando... (esperava seq={c.expected_seq})")
+                self.enviar_ack(c, 0)
+                return None
+            c.ack_binario = False
+            if len(conteudo) < MAX_DATA_SIZE and (c.seq_fin < 0 or seq < c.seq_fin):
+                c.seq_fin = seq
+
+        fim = False
+        if c.concluida:
+            self.duplicados += 1
+            if verboso:
+                info(f"{c.nome} Conexão já concluída: reconfirmando (recebido={seq})")
+        elif seq == c.expected_seq:
+            c.entregar(conteudo)
+            fim = seq == c.seq_fin
+            c.expected_seq += 1
+            if verboso:
+                info(f"{c.nome} Pacote {seq} ACEITO! (novo expectedSeq={c.expected_seq})")
+            # entrega o que já estava guardado e agora ficou em ordem
+            chaves = c.chaves
+            n = 0
+            while not fim and n < len(chaves) and chaves[n] == c.expected_seq:
+                c.entregar(c.fora_de_ordem.pop(chaves[n]))
+                fim = c.expected_seq == c.seq_fin
+                c.expected_seq += 1
+                n += 1
+            del chaves[:n]
+        elif c.expected_seq < seq < c.expected_seq + JANELA_RECEPCAO and seq not in c.fora_de_ordem:
+            c.fora_de_ordem[seq] = conteudo
+            bisect.insort(c.chaves, seq)
+            if verboso:
+                info(f"{c.nome} Fora de ordem, guardado (esperado={c.expected_seq}, recebido={seq})")
+        else:
+            self.duplicados += 1
+            if verboso:
+                info(f"{c.nome} Duplicado/fora da janela (esperado={c.expected_seq}, recebido={seq})")
+
+        self.enviar_ack(c, ts)
+
+        # fim só quando o FIN é entregue em ordem (um FIN adiantado não encerra)
+        if not fim:
+            return None
+        c.concluida = True
+        self.concluidas += 1
+        c.fora_de_ordem.clear()
+        c.chaves.clear()
+        c.fechar()
+        return c
+
+    def enviar_ack(self, c, ts_eco):
+        """ACK cumulativo + SACK, no formato do último pacote da conexão (ver receptor.java)."""
+        ack = c.expected_seq - 1
+        sack = c.blocos_sack()
+        if c.ack_binario:
+            msg = montar_ack(ack, ts_eco, max(0, JANELA_RECEPCAO - len(c.chaves)), sack, ACK_F_CRC32, c.id)
+        else:
+            # a chave 'sack' vai sempre, mesmo vazia: é assim que o emissor sabe que pode usar SR
+            msg = ("{'ack_num':%d,'sack':[%s]}" % (ack, ",".join("[%d,%d]" % tuple(b) for b in sack))).encode()
+        self.sock.sendto(msg, self.destino)
+
+    def executar(self):
+        self.ativo = True
+        self.em_execucao = True
+        espera = None
+        try:
+            while self.ativo:
+                # todas concluídas: o ACK do FIN pode se perder, então reconfirma o que chegar
+                # até espera_fin de silêncio; uma conexão nova no meio volta a esperar
+                todas = bool(self.conexoes) and self.concluidas == len(self.conexoes)
+                nova = self.espera_fin if todas else None
+                if nova != espera:
+                    espera = nova
+                    self.sock.settimeout(espera)
+                try:
+                    dados, _ = self.sock.recvfrom(65535)
+                except socket.timeout:
+                    info("[Receptor] Emissor em silêncio: encerrando.")
+                    break
+                except OSError:
+                    break  # parar()
+                if not dados and not self.ativo:
+                    break
+                c = self.processar(dados)
+                if c is not None and self.anunciar:
+                    self.relatar(c)
+        finally:
+            self.ativo = False
+            for c in self.conexoes.values():
+                c.fechar()
+            self.em_execucao = False
+            self.sock.close()
+
+    def relatar(self, c):
+        print(f"\n{c.nome} Fim da transmissão detectado.")
+        if c.arquivo is not None:
+            print(f"{c.nome} {c.recebidos} bytes gravados em {c.arquivo}")
+        elif c.mensagem is not None:
+            print("\n===== MENSAGEM COMPLETA =====")
+            print(c.mensagem.getvalue().decode("utf-8", errors="replace"))
+            print("=============================")
+
+    def parar(self):
+        """Encerra executar(); o socket só é fechado depois que ele sai (pode estar no meio de um ACK)."""
+        self.ativo = False
+        try:
+            # destrava o recvfrom de executar(); só a leitura, o ACK em andamento ainda sai
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+        if not self.em_execucao:
+            self.sock.close()
+
+
+# --- PRINCIPAL ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receptor (mesmo protocolo e ACKs do receptor.java)")
+    parser.add_argument("arquivo_saida", nargs="?", default=None, help="Grava os dados aqui conforme chegam em ordem; com varias conexoes, em arquivo_saida.<id>")
+    parser.add_argument("-q", "--quieto", action="store_true", help="Sem log por pacote")
+    parser.add_argument("--host", default=RECEPTOR_ADDR[0])
+    parser.add_argument("--porta", type=int, default=RECEPTOR_ADDR[1])
+    parser.add_argument("--ack-host", default=ACK_ADDR[0], help="Para onde vao os ACKs (porta de ACKs do roteador)")
+    parser.add_argument("--ack-port", type=int, default=ACK_ADDR[1])
+    args = parser.parse_args()
+    verboso = not args.quieto
+
+    receptor = Receptor((args.host, args.porta), (args.ack_host, args.ack_port), args.arquivo_saida)
+    print(f"[Receptor] Aguardando pacotes em {receptor.local[0]}:{receptor.local[1]}...")
+    try:
+        receptor.executar()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if len(receptor.conexoes) > 1:
+            print(f"[Receptor] {receptor.concluidas}/{len(receptor.conexoes)} conexões concluídas.")
+        receptor.parar()
+        print("[Receptor] Socket fechado.")
@@ -1,48 +1,637 @@
-import argparse, random, socket, struct, threading, time
+import argparse, bisect, heapq, itertools, json, logging, math, multiprocessing, queue, random, re, selectors, signal, socket, struct, threading, time
 from collections import deque
 
-def scramble_payload(payload: bytes, mode: str = "shuffle") -> bytes:
+from loss_models import GilbertElliottLoss, ProfileLoss, UniformStream, load_profile
+from protocolo import (ACK, ACK_F_CONN, ACK_MENOS_UM, CONN, MAGIC_ACK, conn_do_pacote, desembrulhar, descrever_ack,
+                       seq_do_pacote, tamanho_cabecalho)
+from packet_trace import (F_DROP, F_CORRUPT, F_HOLD, F_RELEASE, F_DUP, F_QUEUE_DROP,
+                          KIND_DECISION, KIND_TX, KIND_EXPIRED, ReplayDecisions, TraceWriter)
+
+log = logging.getLogger("roteador")
+
+DUP_SPACING = 0.02  # intervalo entre o original e a cópia duplicada (s)
+MAX_DATAGRAM = 65535
+
+SCRAMBLE_MODES = ("shuffle", "xor", "bitflip")
+
+def scramble_mode(value: str) -> str:
+    """Valida um modo de corrupção (tipo de 'scramble_mode_fwd' em TUNABLE)."""
+    if value not in SCRAMBLE_MODES:
+        raise ValueError(f"modo de corrupcao invalido: {value!r}")
+    return value
+
+def scramble_payload(payload: bytes, mode: str = "shuffle", rng=random) -> bytes:
     if not payload: return payload
     if mode == "shuffle":
-        lst = list(payload); random.shuffle(lst); return bytes(lst)
+        lst = list(payload); rng.shuffle(lst); return bytes(lst)
     elif mode == "xor":
-        key = random.randrange(1, 256)
+        key = rng.randrange(1, 256)
         return bytes([b ^ key for b in payload])
     elif mode == "bitflip":
         out = bytearray(payload)
-        for _ in range(random.randint(1, 3)):
-            i = random.randrange(len(out))
-            bit = 1 << random.randrange(8)
+        for _ in range(rng.randint(1, 3)):
+            i = rng.randrange(len(out))
+            bit = 1 << rng.randrange(8)
             out[i] ^= bit
         return bytes(out)
     return payload
 
-def maybe(delay_mean):
-    if delay_mean > 0: time.sleep(random.expovariate(1.0 / delay_mean))
+def sample_delay(delay_mean, u=None):
+    """Atraso exponencial de média delay_mean; com u (uniforme pré-sorteada) usa a transformada inversa."""
+    if delay_mean <= 0:
+        return 0.0
+    if u is None:
+        return random.expovariate(1.0 / delay_mean)
+    return -delay_mean * math.log(1.0 - u)
+
+
+def recv_batch(sock, views):
+    """Lê até len(views) datagramas prontos de um socket não bloqueante: lista de (dados, origem).
+
+    recvfrom(65535) aloca 64 KiB por chamada e depois encolhe; aqui os buffers são
+    reaproveitados e só os bytes efetivamente recebidos são copiados.
+    """
+    out = []
+    for view in views:
+        try:
+            n, addr = sock.recvfrom_into(view)
+        except (BlockingIOError, InterruptedError):
+            break
+        out.append((bytes(view[:n]), addr))
+    return out
+
+
+ACK_NUM_RE = re.compile(rb"ack_num\D*?(-?\d+)")
+
+
+def ack_number(data):
+    """Número do ACK, binário ou "{'ack_num':N}" (None se não for um ACK reconhecível)."""
+    if len(data) >= ACK.size and data[0] == MAGIC_ACK:
+        ack = ACK.unpack_from(data)[3]
+        return -1 if ack == ACK_MENOS_UM else ack
+    m = ACK_NUM_RE.search(data)
+    return int(m.group(1)) if m else None
+
+
+def ack_conn(data):
+    """Id de conexão ecoado num ACK binário (ACK_F_CONN); None nos demais."""
+    if len(data) >= ACK.size + CONN.size and data[0] == MAGIC_ACK and data[1] & ACK_F_CONN:
+        return CONN.unpack_from(data, ACK.size)[0]
+    return None
+
+
+def _flow_conn(direction, data):
+    """Id de conexão de um pacote (dados ou ACK), para a chave de fluxo do trace."""
+    return conn_do_pacote(data) if direction == 'fwd' else ack_conn(data)
+
+
+def _forced_tag(fflags, bit):
+    return "FORCED " if fflags & bit else ""
+
+
+class Flow:
+    """Par de portas atendido pelo roteador: socket de ida, socket de ACKs, destinos e tabela de fluxos.
+
+    sender_addr é o destino dos ACKs que a tabela não sabe rotear (o emissor configurado);
+    last_release é o relógio de liberação desses ACKs sem entrada na tabela.
+    """
+    __slots__ = ("sock_fwd", "sock_back", "sender_addr", "receiver_addr", "table", "last_release")
+
+    def __init__(self, sock_fwd, sock_back, sender_addr, receiver_addr, table=None):
+        self.sock_fwd = sock_fwd
+        self.sock_back = sock_back
+        self.sender_addr = sender_addr
+        self.receiver_addr = receiver_addr
+        self.table = table if table is not None else FlowTable()
+        self.last_release = {'fwd': 0.0, 'back': 0.0}
+
+
+class FlowState:
+    """Uma entrada da tabela de fluxos: emissor aprendido, seqs, buffer de reordenação, perfil e contadores."""
+    __slots__ = ("key", "sender_addr", "conn", "conns", "seq_high", "buffer_reorder", "profile", "metrics",
+                 "last_release")
+
+    def __init__(self, key, sender_addr, conn=None, profile=None):
+        self.key = key
+        self.sender_addr = sender_addr  # origem dos dados = destino dos ACKs
+        self.conn = conn  # primeiro id de conexão visto (casa os perfis 'conn:N')
+        self.conns = set()
+        self.seq_high = 0  # maior seq (já desembrulhado) visto neste fluxo
+        self.buffer_reorder = deque()  # (id, data, seq) dos pacotes retidos para reordenação
+        self.profile = profile or {}  # parâmetros que sobrepõem os do roteador
+        self.metrics = RouterMetrics()
+        # último instante de liberação por direção: o atraso sozinho não reordena o fluxo,
+        # e o atraso de um fluxo não segura os outros
+        self.last_release = {'fwd': 0.0, 'back': 0.0}
+
+    def unwrap_seq(self, seq):
+        """Seq de 16 bits do cabeçalho -> contagem contínua do emissor (aritmética serial)."""
+        seq = desembrulhar(seq, self.seq_high)
+        if seq > self.seq_high:
+            self.seq_high = seq
+        return seq
+
+    def name(self):
+        host, port = self.sender_addr
+        return f"{host}:{port}" if self.key == self.sender_addr else f"{host}:{port}#{self.key[1]}"
+
+
+class ConnDirectory:
+    """Id de conexão -> endereço IPv4 do emissor, para rotear ACKs que trazem ACK_F_CONN.
+
+    Uma entrada fixa por id num buffer plano; com --workers o buffer é um RawArray herdado
+    por todos os processos: o ACK de um receptor cai sempre no mesmo worker (SO_REUSEPORT
+    distribui pela origem), que nem sempre é o que viu os dados daquela conexão.
+    """
+    ENTRY = struct.Struct("!4sH")
+
+    def __init__(self, buf=None):
+        self.buf = buf if buf is not None else bytearray(self.ENTRY.size << 16)
+
+    @classmethod
+    def shared(cls):
+        return cls(multiprocessing.RawArray('B', cls.ENTRY.size << 16))
+
+    def learn(self, conn, addr):
+        try:
+            ip = socket.inet_aton(addr[0])
+        except OSError:
+            return
+        self.ENTRY.pack_into(self.buf, conn * self.ENTRY.size, ip, addr[1])
+
+    def lookup(self, conn):
+        ip, port = self.ENTRY.unpack_from(self.buf, conn * self.ENTRY.size)
+        return (socket.inet_ntoa(ip), port) if port else None
+
+
+class FlowProfiles:
+    """Perfis de impairment por fluxo: regras 'match param=valor ...', aplicadas na ordem.
+
+    match: '*', 'conn:N', 'host:port' ou 'host:port#N' (origem dos dados e id de conexão).
+    Os parâmetros são os de UDPRouter.TUNABLE; o que nenhuma regra define segue o valor
+    global do roteador (inclusive quando muda em tempo de execução).
+    """
+
+    def __init__(self, tunable):
+        self.tunable = tunable
+        self.rules = []
+
+    def parse(self, spec):
+        """'match p=v ...' -> (match, {param: valor}); ValueError se inválido."""
+        parts = spec.split()
+        if not parts:
+            raise ValueError("perfil vazio")
+        match, overrides = parts[0], {}
+        self._matcher(match)
+        for item in parts[1:]:
+            name, sep, value = item.partition('=')
+            if not sep or name not in self.tunable:
+                raise ValueError(f"parametro invalido: {item!r}")
+            overrides[name] = self.tunable[name](value)
+        return match, overrides
+
+    def add(self, spec):
+        match, overrides = self.parse(spec)
+        self.rules.append((match, overrides))
+        return match, overrides
+
+    def clear(self):
+        self.rules = []
+
+    @staticmethod
+    def _matcher(match):
+        if match == '*':
+            return None, None
+        if match.startswith('conn:'):
+            return None, int(match[5:])
+        addr, _, conn = match.partition('#')
+        host, sep, port = addr.rpartition(':')
+        if not sep:
+            raise ValueError(f"match invalido: {match!r}")
+        return (host, int(port)), int(conn) if conn else None
+
+    def resolve(self, addr, conn):
+        profile = {}
+        for match, overrides in self.rules:
+            m_addr, m_conn = self._matcher(match)
+            if (m_addr is None or m_addr == tuple(addr)) and (m_conn is None or m_conn == conn):
+                profile.update(overrides)
+        return profile
+
+
+class FlowTable:
+    """Estado por fluxo de um par de portas, chaveado pela origem dos dados ou pelo id de conexão.
+
+    key_mode 'conn': (origem, conn) quando o pacote traz F_CONN, senão só a origem;
+    'addr': só a origem (todas as conexões de um emissor dividem o mesmo estado).
+    ACKs com id voltam para a origem aprendida daquele conn; sem id, para a última
+    origem que mandou dados sem id.
+    """
+
+    def __init__(self, key_mode="conn", profiles=None, directory=None):
+        self.key_mode = key_mode
+        self.profiles = profiles
+        self.directory = directory if directory is not None else ConnDirectory()
+        self.entries = {}
+        self.by_conn = {}
+        self.last_plain = None
+
+    def lookup(self, addr, conn):
+        """Entrada do fluxo de um pacote de dados (criada na primeira vez)."""
+        key = addr if conn is None or self.key_mode == "addr" else (addr, conn)
+        state = self.entries.get(key)
+        if state is None:
+            profile = self.profiles.resolve(addr, conn) if self.profiles else None
+            state = self.entries[key] = FlowState(key, addr, conn, profile)
+        if conn is None:
+            self.last_plain = state
+        elif conn not in state.conns:
+            state.conns.add(conn)
+            self.by_conn[conn] = state
+            self.directory.learn(conn, addr)
+        return state
+
+    def route_ack(self, conn):
+        """(entrada local ou None, destino do ACK ou None) para um ACK com este id."""
+        if conn is None:
+            state = self.last_plain
+            return state, state.sender_addr if state else None
+        state = self.by_conn.get(conn)
+        return state, state.sender_addr if state else self.directory.lookup(conn)
+
+    def reapply(self):
+        """Recalcula os perfis de todas as entradas (depois de mudar as regras)."""
+        for state in list(self.entries.values()):
+            state.profile = self.profiles.resolve(state.sender_addr, state.conn) if self.profiles else {}
+
+    def snapshot(self):
+        return {state.name(): state.metrics.snapshot()["counters"] for state in list(self.entries.values())}
+
+
+class DeliveryScheduler:
+    """Fila de eventos ordenada pelo instante de liberação (heap), drenada por um único laço.
+
+    Atrasos, espaçamento de duplicatas e expiração de pacotes retidos viram eventos
+    agendados, então as threads de recepção nunca dormem e o roteador continua
+    recebendo enquanto milhares de pacotes estão "no enlace".
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()  # desempate estável: mesmo instante => ordem de agendamento
+        self.cond = threading.Condition()
+        self.running = True
+
+    def call_at(self, at, fn, *args):
+        with self.cond:
+            heapq.heappush(self.heap, (at, next(self.counter), fn, args))
+            if self.heap[0][0] == at:
+                self.cond.notify()
+
+    def next_deadline(self):
+        with self.cond:
+            return self.heap[0][0] if self.heap else None
 
+    def pop_due(self, now):
+        due = []
+        with self.cond:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+        return due
 
-def parse_seq_list(spec: str):
-    s = set()
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    wait = self.heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                if not self.running:
+                    return
+            self.run_due()
+
+    def run_due(self):
+        for _, _, fn, args in self.pop_due(time.monotonic()):
+            try:
+                fn(*args)
+            except OSError:  # inclui BlockingIOError: buffer de envio cheio conta como perda
+                pass
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+
+TIME_BUCKETS = tuple(1e-6 * 2 ** i for i in range(24))  # 1 us .. ~8 s
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+
+class Histogram:
+    """Histograma de baldes fixos (limites superiores crescentes) com contagem, soma e máximo."""
+    __slots__ = ("bounds", "counts", "total", "n", "max")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Limite superior do balde que contém o quantil q (aproximação por baldes)."""
+        target, acc = q * self.n, 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if c and acc >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return 0
+
+    def snapshot(self):
+        buckets = {f"{b:g}": c for b, c in zip(self.bounds, self.counts) if c}
+        if self.counts[-1]:
+            buckets["+inf"] = self.counts[-1]
+        return {"count": self.n, "mean": self.total / self.n if self.n else 0, "max": self.max,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99), "buckets": buckets}
+
+
+class RouterMetrics:
+    """Contadores de pacotes/bytes por (direção, ação) e histogramas nomeados.
+
+    Ações: rx, tx, drop, corrupt, dup, hold, reorder, expired, queue_drop. Histogramas: atraso
+    injetado (delay_fwd/delay_back), profundidade e permanência na fila do gargalo
+    (queue_depth_*/sojourn_*), ocupação do buffer de reordenação e tempo de processamento do
+    próprio roteador por pacote (proc_fwd/proc_back), separado das impairments.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.counters = {}
+            self.hists = {}
+
+    def count(self, direction, action, nbytes):
+        with self.lock:
+            c = self.counters.get((direction, action))
+            if c is None:
+                c = self.counters[(direction, action)] = [0, 0]
+            c[0] += 1
+            c[1] += nbytes
+
+    def observe(self, name, value, bounds=TIME_BUCKETS):
+        with self.lock:
+            h = self.hists.get(name)
+            if h is None:
+                h = self.hists[name] = Histogram(bounds)
+            h.observe(value)
+
+    def packets(self, direction, action):
+        with self.lock:
+            return self.counters.get((direction, action), (0, 0))[0]
+
+    def snapshot(self):
+        with self.lock:
+            counters = {}
+            for (direction, action), (pkts, nbytes) in sorted(self.counters.items()):
+                counters.setdefault(direction, {})[action] = {"packets": pkts, "bytes": nbytes}
+            return {"uptime": time.monotonic() - self.started, "counters": counters,
+                    "histograms": {name: h.snapshot() for name, h in sorted(self.hists.items())}}
+
+
+class LinkShaper:
+    """Gargalo de um sentido do enlace: token bucket (taxa + rajada) e fila FIFO limitada com AQM.
+
+    Trabalha em tempo virtual: ao chegar, o pacote recebe o instante em que sai da fila
+    (serialização pelo token bucket) e a fila é o conjunto de pacotes cuja saída ainda
+    não ocorreu. Nada dorme; a saída vira evento no DeliveryScheduler.
+    aqm: 'taildrop' (descarta com a fila cheia), 'red' (descarte aleatório pela média
+    da fila) ou 'codel' (descarta quando a permanência fica acima do alvo por um intervalo).
+    """
+
+    def __init__(self, rate, burst=0, limit=0, aqm="taildrop", red_min=None, red_max=None, red_p=0.1,
+                 red_weight=0.002, codel_target=0.005, codel_interval=0.1):
+        self.rate = rate  # bytes/s; 0 = sem limite de taxa
+        self.burst = burst if burst > 0 else 1500
+        self.limit = limit  # pacotes; 0 = fila ilimitada
+        self.aqm = aqm
+        self.red_min = red_min if red_min is not None else 0.25 * limit
+        self.red_max = red_max if red_max is not None else 0.75 * limit
+        if limit and rate <= 0:
+            raise ValueError("fila limitada sem taxa: sem token bucket a fila nunca se forma")
+        if aqm == "red" and not self.red_min < self.red_max:
+            raise ValueError("RED precisa de red_min < red_max (ou de limit > 0 para os padrões)")
+        self.red_p = red_p
+        self.red_weight = red_weight
+        self.codel_target = codel_target
+        self.codel_interval = codel_interval
+        self.rand = random.random  # o roteador troca pelo seu fluxo com semente
+        self.tokens = self.burst
+        self.t_tokens = 0.0
+        self.last_departure = 0.0
+        self.departures = deque()  # instantes de saída dos pacotes ainda na fila
+        self.avg = 0.0
+        self.codel_first_above = None
+        self.codel_dropping = False
+        self.codel_count = 0
+        self.codel_next = 0.0
+
+    def admit(self, now, size):
+        """Devolve (instante de saída ou None se descartado, profundidade da fila na chegada)."""
+        deps = self.departures
+        while deps and deps[0] <= now:
+            deps.popleft()
+        qlen = len(deps)
+        if self.rate <= 0:
+            return now, qlen
+        start = max(now, self.last_departure)
+        tokens = min(self.burst, self.tokens + (start - self.t_tokens) * self.rate)
+        depart = start if tokens >= size else start + (size - tokens) / self.rate
+        if self._drop(now, qlen, depart - now):
+            return None, qlen
+        self.tokens = tokens - size if tokens >= size else 0.0
+        self.t_tokens = self.last_departure = depart
+        deps.append(depart)
+        return depart, qlen
+
+    def _drop(self, now, qlen, sojourn):
+        if self.limit and qlen >= self.limit:
+            return True
+        if self.aqm == "red":
+            self.avg += self.red_weight * (qlen - self.avg)
+            if self.avg < self.red_min:
+                return False
+            if self.avg >= self.red_max:
+                return True
+            return self.rand() < self.red_p * (self.avg - self.red_min) / (self.red_max - self.red_min)
+        if self.aqm == "codel":
+            if sojourn < self.codel_target or qlen == 0:
+                self.codel_first_above = None
+                self.codel_dropping = False
+                return False
+            if self.codel_first_above is None:
+                self.codel_first_above = now + self.codel_interval
+                return False
+            if not self.codel_dropping and now >= self.codel_first_above:
+                self.codel_dropping = True
+                self.codel_count = 1
+                self.codel_next = now + self.codel_interval
+                return True
+            if self.codel_dropping and now >= self.codel_next:
+                self.codel_count += 1
+                self.codel_next += self.codel_interval / self.codel_count ** 0.5
+                return True
+        return False
+
+
+SEQ_MODULUS = 1 << 16  # espaço de números de sequência do cabeçalho ("!H"); os seqs chegam desembrulhados
+
+
+class SeqRuleSet:
+    """Conjunto imutável de números de sequência.
+
+    Guarda intervalos ordenados e disjuntos (busca por bisect, memória O(#intervalos))
+    e padrões "a cada N" (seq % n == r). Com `modulus`, o seq é reduzido antes da busca,
+    então regras continuam valendo depois que o contador dá a volta.
+    """
+    __slots__ = ("starts", "ends", "patterns", "modulus")
+
+    def __init__(self, intervals=(), patterns=(), modulus=None):
+        merged = []
+        for a, b in sorted(intervals):
+            if merged and a <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        self.starts = tuple(a for a, _ in merged)
+        self.ends = tuple(b for _, b in merged)
+        self.patterns = frozenset(patterns)
+        self.modulus = modulus
+
+    @classmethod
+    def of(cls, seqs, modulus=None):
+        """Converte um iterável de seqs (ou outro SeqRuleSet) em intervalos."""
+        if isinstance(seqs, SeqRuleSet):
+            return seqs
+        return cls(((s, s) for s in seqs), modulus=modulus)
+
+    def __contains__(self, seq):
+        if self.modulus:
+            seq %= self.modulus
+        i = bisect.bisect_right(self.starts, seq) - 1
+        if i >= 0 and seq <= self.ends[i]:
+            return True
+        for n, r in self.patterns:
+            if seq % n == r:
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self.starts or self.patterns)
+
+    def intervals(self):
+        return list(zip(self.starts, self.ends))
+
+    def _modulus_with(self, other):
+        # as regras novas (já lidas com o módulo do roteador) mandam; sem módulo, fica o atual
+        return other.modulus if other.modulus is not None else self.modulus
+
+    def union(self, other):
+        return SeqRuleSet(self.intervals() + other.intervals(), self.patterns | other.patterns,
+                          self._modulus_with(other))
+
+    def difference(self, other):
+        """Remove os intervalos e padrões idênticos de `other` (um intervalo não recorta padrões)."""
+        out = []
+        cuts = other.intervals()
+        for a, b in self.intervals():
+            i = bisect.bisect_right(other.ends, a - 1) if cuts else 0  # primeiro corte que termina em >= a
+            while a <= b and i < len(cuts) and cuts[i][0] <= b:
+                ca, cb = cuts[i]
+                if ca > a:
+                    out.append((a, ca - 1))
+                a = max(a, cb + 1)
+                i += 1
+            if a <= b:
+                out.append((a, b))
+        return SeqRuleSet(out, self.patterns - other.patterns, self._modulus_with(other))
+
+    def __str__(self):
+        parts = [str(a) if a == b else f"{a}-{b}" for a, b in self.intervals()]
+        parts += [f"%{n}" + (f"+{r}" if r else "") for n, r in sorted(self.patterns)]
+        return ",".join(parts) or "-"
+
+
+def parse_seq_list(spec: str, modulus=SEQ_MODULUS):
+    """Lê regras como '2,5-7,65530-5,%10,%4+1'.
+
+    'a-b' com a > b dá a volta no espaço de seqs; '%n' casa a cada n seqs e '%n+r'
+    casa seq % n == r. Entradas inválidas são ignoradas.
+    """
+    intervals, patterns = [], []
     if not spec:
-        return s
+        return SeqRuleSet(modulus=modulus)
     for part in spec.split(','):
         part = part.strip()
         if not part:
             continue
-        if '-' in part:
-            a, b = part.split('-', 1)
-            try:
+        try:
+            if part.startswith('%'):
+                n, _, r = part[1:].partition('+')
+                n = int(n); r = int(r or 0)
+                if n > 0:
+                    patterns.append((n, r % n))
+            elif '-' in part:
+                a, b = part.split('-', 1)
                 a_i = int(a); b_i = int(b)
-            except Exception:
-                continue
-            if a_i <= b_i:
-                s.update(range(a_i, b_i + 1))
-        else:
-            try:
-                s.add(int(part))
-            except Exception:
-                continue
-    return s
+                if a_i <= b_i:
+                    intervals.append((a_i, b_i))
+                elif modulus:
+                    intervals += [(a_i, modulus - 1), (0, b_i)]
+            else:
+                intervals.append((int(part), int(part)))
+        except ValueError:
+            continue
+    return SeqRuleSet(intervals, patterns, modulus)
+
+
+FORCED_TYPES = ('drop', 'corrupt', 'dup', 'reorder')
+
+
+class ForcedRules:
+    """Snapshot imutável das regras forçadas; o plano de controle publica um novo por troca de referência.
+
+    Tipos omitidos começam vazios com `modulus` (o do roteador), para que regras somadas
+    depois continuem reduzindo o seq.
+    """
+    __slots__ = FORCED_TYPES
+
+    def __init__(self, drop=None, corrupt=None, dup=None, reorder=None, modulus=None):
+        self.drop = drop if drop is not None else SeqRuleSet(modulus=modulus)
+        self.corrupt = corrupt if corrupt is not None else SeqRuleSet(modulus=modulus)
+        self.dup = dup if dup is not None else SeqRuleSet(modulus=modulus)
+        self.reorder = reorder if reorder is not None else SeqRuleSet(modulus=modulus)
+
+    def replace(self, typ, rules):
+        fields = {t: getattr(self, t) for t in FORCED_TYPES}
+        fields[typ] = rules
+        return ForcedRules(**fields)
+
+
 
 class UDPRouter:
     def __init__(self, router_host, router_port,
@@ -51,15 +640,20 @@ class UDPRouter:
                  p_corrupt_fwd, p_drop_fwd, p_dup_fwd,
                  p_reorder_fwd, delay_mean_fwd, scramble_mode_fwd,
                  p_drop_back, p_dup_back, delay_mean_back,
-                 reorder_window,
-                 force_drop_seqs=None, force_corrupt_seqs=None, force_dup_seqs=None, force_reorder_seqs=None):
+                 reorder_window, reorder_hold_max=1.0, seq_modulus=SEQ_MODULUS, log_sample=1, seed=None,
+                 force_drop_seqs=None, force_corrupt_seqs=None, force_dup_seqs=None, force_reorder_seqs=None,
+                 ack_port=9003, flow_key="conn", reuse_port=False, directory=None):
         self.router_addr = (router_host, router_port)
         self.sender_addr = (sender_host, sender_port)
         self.receiver_addr = (receiver_host, receiver_port)
-        self.sock_fwd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock_back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock_fwd.bind(self.router_addr)
-        self.sock_back.bind(("0.0.0.0", 9003))
+        # reuse_port: vários processos escutam as mesmas portas e o kernel divide os fluxos
+        self.reuse_port = reuse_port
+        self.flow_key = flow_key
+        self.profiles = FlowProfiles(self.TUNABLE)
+        self.sock_fwd = self._bind(self.router_addr)
+        self.sock_back = self._bind(("0.0.0.0", ack_port))
+        self.flows = [Flow(self.sock_fwd, self.sock_back, self.sender_addr, self.receiver_addr,
+                           FlowTable(flow_key, self.profiles, directory))]
         self.p_corrupt_fwd = p_corrupt_fwd
         self.p_drop_fwd = p_drop_fwd
         self.p_dup_fwd = p_dup_fwd
@@ -70,198 +664,659 @@ class UDPRouter:
         self.p_dup_back = p_dup_back
         self.delay_mean_back = delay_mean_back
         self.reorder_window = max(0, reorder_window)
-        self.buffer_reorder = deque()
+        self.reorder_hold_max = reorder_hold_max
+        self.hold_ids = itertools.count()
         self.lock = threading.Lock()
+        self.scheduler = DeliveryScheduler()
+        # gargalo opcional por direção (LinkShaper), configurado com set_shaper
+        self.shapers = {'fwd': None, 'back': None}
+        # sorteios, replay, gargalos e relógios de liberação (FlowState.last_release): no motor
+        # threads várias threads de recepção (e o controle, em resume/step) decidem ao mesmo tempo
+        self.decision_lock = threading.Lock()
         self.running = True
-        # forced sequences to deterministically apply errors
-        self.force_drop_seqs = set(force_drop_seqs or [])
-        self.force_corrupt_seqs = set(force_corrupt_seqs or [])
-        self.force_dup_seqs = set(force_dup_seqs or [])
-        self.force_reorder_seqs = set(force_reorder_seqs or [])
+        self.metrics = RouterMetrics()
+        # decisões aleatórias vêm de blocos pré-gerados com semente (reprodutível com --seed)
+        self.stream = UniformStream(seed)
+        self.rand = self.stream.next
+        self.rng = random.Random(seed)
+        self.loss_model = None  # None = Bernoulli com p_drop_fwd (ajustável ao vivo)
+        self.trace = None   # TraceWriter: decisões e envios, gravados fora do caminho quente
+        self.replay = None  # ReplayDecisions: reaplica as decisões de um trace anterior
+        self.log_sample = max(1, log_sample)
+        self.log_counter = itertools.count()
+        # forced sequences to deterministically apply errors.
+        # Leitores pegam self.forced uma vez por pacote, sem lock; escritores trocam o snapshot inteiro.
+        self.control_lock = threading.Lock()
+        self.seq_modulus = seq_modulus
+        self.forced = ForcedRules(*(SeqRuleSet.of(x or (), seq_modulus) for x in
+                                    (force_drop_seqs, force_corrupt_seqs, force_dup_seqs, force_reorder_seqs)))
         self.interactive_mode = False  # Modo interativo desligado por padrão
+        self.interactive_queue = queue.Queue()  # pacotes aguardando decisão no console interativo
+        # pause/step: pacotes ficam enfileirados em vez de bloquear a recepção
+        self.paused = False
+        self.step_credits = 0
+        self.paused_queue = deque()
+        self.sock_ctl = None
 
     # --- runtime control of forced rules ---
+    force_drop_seqs = property(lambda self: self.forced.drop)
+    force_corrupt_seqs = property(lambda self: self.forced.corrupt)
+    force_dup_seqs = property(lambda self: self.forced.dup)
+    force_reorder_seqs = property(lambda self: self.forced.reorder)
+
+    def _update_forced(self, typ, fn):
+        if typ not in FORCED_TYPES:
+            return
+        with self.control_lock:
+            forced = self.forced
+            self.forced = forced.replace(typ, fn(getattr(forced, typ)))
+
     def add_forced(self, typ: str, seqs):
-        if typ == 'drop':
-            self.force_drop_seqs.update(seqs)
-        elif typ == 'corrupt':
-            self.force_corrupt_seqs.update(seqs)
-        elif typ == 'dup':
-            self.force_dup_seqs.update(seqs)
-        elif typ == 'reorder':
-            self.force_reorder_seqs.update(seqs)
+        seqs = SeqRuleSet.of(seqs, self.seq_modulus)
+        self._update_forced(typ, lambda cur: cur.union(seqs))
 
     def remove_forced(self, typ: str, seqs):
-        target = None
-        if typ == 'drop':
-            target = self.force_drop_seqs
-        elif typ == 'corrupt':
-            target = self.force_corrupt_seqs
-        elif typ == 'dup':
-            target = self.force_dup_seqs
-        elif typ == 'reorder':
-            target = self.force_reorder_seqs
-        if target is not None:
-            for s in seqs:
-                target.discard(s)
+        seqs = SeqRuleSet.of(seqs, self.seq_modulus)
+        self._update_forced(typ, lambda cur: cur.difference(seqs))
+
+    def set_forced(self, typ: str, seqs):
+        seqs = SeqRuleSet.of(seqs, self.seq_modulus)
+        self._update_forced(typ, lambda cur: seqs)
 
     def clear_forced(self, typ: str = None):
         if typ is None:
-            self.force_drop_seqs.clear(); self.force_corrupt_seqs.clear(); self.force_dup_seqs.clear(); self.force_reorder_seqs.clear()
-        elif typ == 'drop':
-            self.force_drop_seqs.clear()
-        elif typ == 'corrupt':
-            self.force_corrupt_seqs.clear()
-        elif typ == 'dup':
-            self.force_dup_seqs.clear()
-        elif typ == 'reorder':
-            self.force_reorder_seqs.clear()
+            with self.control_lock:
+                self.forced = ForcedRules(modulus=self.seq_modulus)
+        else:
+            self._update_forced(typ, lambda cur: SeqRuleSet(modulus=self.seq_modulus))
+
+    def format_forced(self):
+        forced = self.forced
+        return "Forced rules:\n" + "\n".join(f"  {typ}: {getattr(forced, typ)}" for typ in FORCED_TYPES)
 
     def show_forced(self):
-        print("Forced rules:")
-        print(f"  drop: {sorted(self.force_drop_seqs)}")
-        print(f"  corrupt: {sorted(self.force_corrupt_seqs)}")
-        print(f"  dup: {sorted(self.force_dup_seqs)}")
-        print(f"  reorder: {sorted(self.force_reorder_seqs)}")
+        print(self.format_forced())
+
+    # --- plano de controle fora de banda ---
+    TUNABLE = {
+        'p_corrupt_fwd': float, 'p_drop_fwd': float, 'p_dup_fwd': float, 'p_reorder_fwd': float,
+        'delay_mean_fwd': float, 'scramble_mode_fwd': scramble_mode,
+        'p_drop_back': float, 'p_dup_back': float, 'delay_mean_back': float,
+        'reorder_window': int, 'reorder_hold_max': float,
+    }
+    CONTROL_HELP = ("add|remove|set <type> <list> | clear [type] | show | get [param] | param <name> <value> | "
+                    "profile [<match> <name>=<value> ...|clear] | flows | pause | step [N] | resume | status | stats [reset]")
+
+    def execute_command(self, line: str) -> str:
+        """Executa um comando de controle em texto ('add drop 2,5-7') ou JSON.
+
+        JSON: {"cmd": "add", "args": ["drop", "2,5-7"]}; a resposta volta como
+        {"ok": ..., "result": ...}. Texto recebe texto.
+        """
+        line = line.strip()
+        if line.startswith('{'):
+            try:
+                req = json.loads(line)
+                ok, result = self._dispatch(str(req.get('cmd', '')).lower(), [str(a) for a in req.get('args', [])])
+            except (ValueError, AttributeError, TypeError) as e:
+                ok, result = False, f"JSON invalido: {e}"
+            return json.dumps({"ok": ok, "result": result})
+        parts = line.split(None, 2)
+        if not parts:
+            return ""
+        ok, result = self._dispatch(parts[0].lower(), parts[1:])
+        return result if isinstance(result, str) else json.dumps(result)
+
+    def _dispatch(self, cmd, args):
+        if cmd in ('add', 'remove', 'set'):
+            if len(args) < 2 or args[0] not in FORCED_TYPES:
+                return False, 'Usage: add|remove|set <drop|corrupt|dup|reorder> <list>'
+            typ, seqs = args[0], parse_seq_list(args[1], self.seq_modulus)
+            if cmd == 'add':
+                self.add_forced(typ, seqs); return True, f'Added {seqs} to {typ}'
+            if cmd == 'remove':
+                self.remove_forced(typ, seqs); return True, f'Removed {seqs} from {typ}'
+            self.set_forced(typ, seqs); return True, f'Set {typ} to {seqs}'
+        if cmd == 'clear':
+            if not args:
+                self.clear_forced(); return True, 'All forced rules cleared'
+            if args[0] not in FORCED_TYPES:
+                return False, f'Tipo desconhecido: {args[0]}'
+            self.clear_forced(args[0]); return True, f'Cleared {args[0]}'
+        if cmd == 'show':
+            return True, self.format_forced()
+        if cmd == 'get':
+            names = args[:1] or sorted(self.TUNABLE)
+            if any(n not in self.TUNABLE for n in names):
+                return False, f'Parametro desconhecido: {names[0]}'
+            return True, {n: getattr(self, n) for n in names}
+        if cmd == 'param':
+            if len(args) < 2 or args[0] not in self.TUNABLE:
+                return False, 'Usage: param <' + '|'.join(sorted(self.TUNABLE)) + '> <value>'
+            try:
+                value = self.TUNABLE[args[0]](args[1])
+            except ValueError:
+                return False, f'Valor invalido: {args[1]}'
+            setattr(self, args[0], value)
+            return True, f'{args[0]} = {value}'
+        if cmd == 'profile':
+            if not args:
+                return True, [f"{m} " + " ".join(f"{k}={v}" for k, v in o.items()) for m, o in self.profiles.rules]
+            if args[0] == 'clear':
+                self.clear_profiles(); return True, 'Perfis removidos'
+            try:
+                match, overrides = self.add_profile(" ".join(args))
+            except ValueError as e:
+                return False, f'Perfil invalido: {e}'
+            return True, f'Perfil {match}: {overrides}'
+        if cmd == 'flows':
+            return True, self.flow_stats()
+        if cmd == 'pause':
+            self.paused = True
+            return True, 'Encaminhamento pausado (pacotes ficam na fila)'
+        if cmd == 'step':
+            try:
+                n = int(args[0]) if args else 1
+            except ValueError:
+                return False, f'Valor invalido: {args[0]}'
+            if n < 1:
+                return False, f'Valor invalido: {n} (step libera ao menos 1 pacote)'
+            return True, f'Liberados {self.step(n)} pacote(s); fila={len(self.paused_queue)}'
+        if cmd == 'resume':
+            return True, f'Retomado; {self.resume()} pacote(s) da fila liberados'
+        if cmd == 'stats':
+            if args and args[0] == 'reset':
+                self.metrics.reset(); return True, 'Metricas zeradas'
+            return True, self.metrics.snapshot()
+        if cmd == 'status':
+            return True, {'loss_model': self.loss_model.describe() if self.loss_model else 'bernoulli',
+                          'paused': self.paused, 'queued': len(self.paused_queue), 'step_credits': self.step_credits}
+        return False, 'Comando desconhecido. ' + self.CONTROL_HELP
+
+    def step(self, n):
+        """Libera n pacotes: primeiro os já enfileirados, o restante vale para os próximos a chegar."""
+        released = []
+        with self.lock:
+            while n > 0 and self.paused_queue:
+                released.append(self.paused_queue.popleft()); n -= 1
+            self.step_credits += n
+        for flow, state, data, seq in released:
+            self._process_packet_auto(flow, state, data, seq)
+        return len(released)
+
+    def resume(self):
+        with self.lock:
+            self.paused = False
+            self.step_credits = 0
+            released = list(self.paused_queue)
+            self.paused_queue.clear()
+        for flow, state, data, seq in released:
+            self._process_packet_auto(flow, state, data, seq)
+        return len(released)
+
+    def open_control(self, port, host="127.0.0.1"):
+        """Abre o endpoint UDP de controle: um comando por datagrama, resposta para o remetente."""
+        self.sock_ctl = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_ctl.bind((host, port))
+        log.info("[Router] Controle em udp://%s:%s", host, port)
+
+    def serve_control_once(self):
+        data, addr = self.sock_ctl.recvfrom(MAX_DATAGRAM)
+        reply = self.execute_command(data.decode('utf-8', errors='replace'))
+        self.sock_ctl.sendto(reply.encode('utf-8'), addr)
+
+    def thread_control(self):
+        while self.running:
+            try:
+                self.serve_control_once()
+            except OSError:
+                if not self.running:
+                    break
+
+    def set_shaper(self, direction, shaper):
+        if shaper is not None:
+            shaper.rand = self.rand
+        self.shapers[direction] = shaper
+
+    def open_trace(self, path):
+        self.trace = TraceWriter(path)
+
+    def load_replay(self, path):
+        """Reaplica as decisões gravadas por seq; seqs ausentes do trace voltam ao sorteio."""
+        self.replay = ReplayDecisions(path)
+
+    def set_loss_model(self, model):
+        """Troca o modelo de perda do sentido emissor->receptor (None volta ao Bernoulli de p_drop_fwd)."""
+        self.loss_model = model
+
+    def add_profile(self, spec):
+        """Acrescenta uma regra de perfil ('match p=v ...') e reaplica aos fluxos já conhecidos."""
+        rule = self.profiles.add(spec)
+        for flow in self.flows:
+            flow.table.reapply()
+        return rule
+
+    def clear_profiles(self):
+        self.profiles.clear()
+        for flow in self.flows:
+            flow.table.reapply()
+
+    def flow_stats(self):
+        """Contadores de cada fluxo conhecido, por par de portas do roteador."""
+        return {f"{flow.sock_fwd.getsockname()[1]}": flow.table.snapshot() for flow in self.flows}
+
+    def _bind(self, addr):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(addr)
+        return sock
+
+    def add_flow(self, router_port, receiver_addr, ack_port, sender_addr, directory=None):
+        """Registra um par emissor/receptor extra com sockets e tabela de fluxos próprios (mesmos perfis)."""
+        sock_fwd = self._bind((self.router_addr[0], router_port))
+        sock_back = self._bind(("0.0.0.0", ack_port))
+        flow = Flow(sock_fwd, sock_back, sender_addr, receiver_addr, FlowTable(self.flow_key, self.profiles, directory))
+        self.flows.append(flow)
+        return flow
 
     def stop(self):
         self.running = False
-        self.sock_fwd.close()
-        self.sock_back.close()
+        self.scheduler.stop()
+        for flow in self.flows:
+            for sock in (flow.sock_fwd, flow.sock_back):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)  # destrava o recvfrom das threads (motor threads)
+                except OSError:
+                    pass
+                sock.close()
+        if self.sock_ctl:
+            self.sock_ctl.close()
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            trace.close()
 
-    def thread_forward(self):
-        print(f"[Router] Escutando do emissor em {self.router_addr}, para {self.receiver_addr}")
+    def thread_forward(self, flow=None):
+        flow = flow or self.flows[0]
+        log.info("[Router] Escutando do emissor em %s, para %s", flow.sock_fwd.getsockname(), flow.receiver_addr)
         while self.running:
             try:
-                data, _ = self.sock_fwd.recvfrom(65535)
+                data, addr = flow.sock_fwd.recvfrom(MAX_DATAGRAM)
             except OSError:
                 break
-            # extrair seq num (se disponível)
-            seq = None
-            if len(data) >= 2:
-                try:
-                    seq = struct.unpack("!H", data[:2])[0]
-                except Exception:
-                    seq = None
-
-            # Menu interativo para cada pacote
-            if hasattr(self, 'interactive_mode') and self.interactive_mode:
-                print(f"\n{'='*60}")
-                print(f"PACOTE RECEBIDO: seq={seq if seq is not None else '?'}")
-                print(f"{'='*60}")
-                print("O que fazer com este pacote?")
-                print("  1 - Enviar normalmente")
-                print("  2 - PERDER (drop)")
-                print("  3 - CORROMPER")
-                print("  4 - DUPLICAR")
-                print("  5 - Modo automático (desliga interativo)")
-                
+            self.handle_forward(flow, data, addr)
+
+    def handle_forward(self, flow, data, addr=None):
+        t0 = time.perf_counter()
+        self._forward(flow, data, addr)
+        self.metrics.observe('proc_fwd', time.perf_counter() - t0)
+
+    def _forward(self, flow, data, addr=None):
+        self.metrics.count('fwd', 'rx', len(data))
+        # entrada na tabela de fluxos pela origem (e id de conexão, se o cabeçalho trouxer)
+        state = flow.table.lookup(addr or flow.sender_addr, conn_do_pacote(data))
+        state.metrics.count('fwd', 'rx', len(data))
+        # extrair seq num (se disponível; cabeçalho v1 ou v2), já sem a volta dos 16 bits
+        seq = seq_do_pacote(data)
+        if seq is not None:
+            seq = state.unwrap_seq(seq)
+
+        # Modo interativo: a decisão é tomada no console, a recepção segue livre
+        if self.interactive_mode:
+            self.interactive_queue.put((flow, state, data, seq))
+            return
+        if self.paused:
+            with self.lock:
+                if self.step_credits > 0:
+                    self.step_credits -= 1
+                else:
+                    self.paused_queue.append((flow, state, data, seq))
+                    return
+        # Modo automático (original)
+        self._process_packet_auto(flow, state, data, seq)
+
+    def interactive_loop(self):
+        """Console que decide o destino de cada pacote enfileirado por handle_forward."""
+        while self.running:
+            try:
+                flow, state, data, seq = self.interactive_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not self.interactive_mode:
+                self._process_packet_auto(flow, state, data, seq)
+                continue
+            print(f"\n{'='*60}")
+            print(f"PACOTE RECEBIDO: fluxo={state.name()} seq={seq if seq is not None else '?'} (na fila: {self.interactive_queue.qsize()})")
+            print(f"{'='*60}")
+            print("O que fazer com este pacote?")
+            print("  1 - Enviar normalmente")
+            print("  2 - PERDER (drop)")
+            print("  3 - CORROMPER")
+            print("  4 - DUPLICAR")
+            print("  5 - Modo automático (desliga interativo)")
+            
+            try:
                 escolha = input("Escolha (1-5): ").strip()
+            except EOFError:
+                escolha = '5'
+            
+            now = time.monotonic()
+            if escolha == '1':
+                print(f"[Router→] ENVIANDO normalmente seq={seq}")
+                self._send(now, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
                 
-                if escolha == '1':
-                    print(f"[Router→] ENVIANDO normalmente seq={seq}")
-                    self.sock_fwd.sendto(data, self.receiver_addr)
-                    
-                elif escolha == '2':
-                    print(f"[Router→] PERDENDO pacote seq={seq}")
-                    continue
-                    
-                elif escolha == '3':
-                    data_corrupted = data[:4] + scramble_payload(data[4:], self.scramble_mode_fwd)
-                    print(f"[Router→] CORROMPENDO pacote seq={seq}")
-                    self.sock_fwd.sendto(data_corrupted, self.receiver_addr)
-                    
-                elif escolha == '4':
-                    print(f"[Router→] DUPLICANDO pacote seq={seq}")
-                    self.sock_fwd.sendto(data, self.receiver_addr)
-                    time.sleep(0.02)
-                    self.sock_fwd.sendto(data, self.receiver_addr)
-                        
-                elif escolha == '5':
-                    self.interactive_mode = False
-                    print("[Router] Modo interativo DESLIGADO - usando probabilidades")
-                    # Processa este pacote automaticamente
-                    self._process_packet_auto(data, seq)
+            elif escolha == '2':
+                print(f"[Router→] PERDENDO pacote seq={seq}")
+                
+            elif escolha == '3':
+                h = tamanho_cabecalho(data)
+                data_corrupted = data[:h] + scramble_payload(data[h:], self._param(state, 'scramble_mode_fwd'), self.rng)
+                print(f"[Router→] CORROMPENDO pacote seq={seq}")
+                self._send(now, 'fwd', flow.sock_fwd, data_corrupted, flow.receiver_addr, seq, state)
+                
+            elif escolha == '4':
+                print(f"[Router→] DUPLICANDO pacote seq={seq}")
+                self._send(now, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
+                self._send(now + DUP_SPACING, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
                     
-                else:
-                    print("Opção inválida! Enviando normalmente...")
-                    self.sock_fwd.sendto(data, self.receiver_addr)
+            elif escolha == '5':
+                self.interactive_mode = False
+                print("[Router] Modo interativo DESLIGADO - usando probabilidades")
+                # Processa este pacote (e os que estão na fila) automaticamente
+                self._process_packet_auto(flow, state, data, seq)
+                
             else:
-                # Modo automático (original)
-                self._process_packet_auto(data, seq)
-
-    def _process_packet_auto(self, data, seq):
-        """Processa pacote automaticamente usando probabilidades"""
-        # Forçar DROP por seq ou aleatório
-        if seq is not None and seq in self.force_drop_seqs:
-            print(f"[Router→] FORCED DROP pacote seq={seq}")
-            return
-        if random.random() < self.p_drop_fwd:
-            print("[Router→] DROP pacote")
+                print("Opção inválida! Enviando normalmente...")
+                self._send(now, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
+
+    def _param(self, state, name):
+        """Parâmetro de impairment do fluxo: o do seu perfil, senão o global do roteador."""
+        profile = state.profile if state is not None else None
+        return profile[name] if profile and name in profile else getattr(self, name)
+
+    def _decide_fwd(self, seq, forced, state=None):
+        """Sorteia as decisões de um pacote: (flags, flags vindas de regras forçadas, atraso)."""
+        fflags = 0
+        if seq is not None:
+            if seq in forced.drop: fflags |= F_DROP
+            if seq in forced.corrupt: fflags |= F_CORRUPT
+            if seq in forced.reorder: fflags |= F_HOLD
+            if seq in forced.dup: fflags |= F_DUP
+        flags = fflags
+        p = state.profile if state is not None else {}
+        if 'p_drop_fwd' in p:
+            lost = self.rand() < p['p_drop_fwd']  # o perfil do fluxo troca o modelo de perda por Bernoulli
+        else:
+            lost = self.loss_model.lost(time.monotonic()) if self.loss_model else self.rand() < self.p_drop_fwd
+        if lost:
+            flags |= F_DROP
+        if self.rand() < self._param(state, 'p_corrupt_fwd'):
+            flags |= F_CORRUPT
+        if self._param(state, 'reorder_window') > 0 and self.rand() < self._param(state, 'p_reorder_fwd'):
+            flags |= F_HOLD
+        if self.rand() < 0.5:
+            flags |= F_RELEASE  # só vale se houver pacote retido (ou a janela de reordenação encher)
+        if self.rand() < self._param(state, 'p_dup_fwd'):
+            flags |= F_DUP
+        return flags, fflags, sample_delay(self._param(state, 'delay_mean_fwd'), self.rand())
+
+    def _process_packet_auto(self, flow, state, data, seq):
+        """Processa pacote automaticamente usando probabilidades (ou as decisões gravadas, em replay)"""
+        with self.decision_lock:
+            rec = (self.replay.next('fwd', seq, conn_do_pacote(data))
+                   if self.replay is not None and seq is not None else None)
+            if rec is None:
+                flags, fflags, delay = self._decide_fwd(seq, self.forced, state)
+            else:
+                (flags, delay), fflags = rec, 0
+        n = len(data)
+        if flags & F_DROP:
+            self._event('fwd', 'drop', n, "[Router→] %sDROP pacote seq=%s", _forced_tag(fflags, F_DROP), seq, state=state)
+            self._trace_decision('fwd', seq, data, F_DROP, 0.0, state.sender_addr)
             return
 
-        # Forçar CORRUPT por seq ou aleatório
-        if seq is not None and seq in self.force_corrupt_seqs:
-            data = data[:4] + scramble_payload(data[4:], self.scramble_mode_fwd)
-            print(f"[Router→] FORCED CORRUPT seq={seq}")
-        elif random.random() < self.p_corrupt_fwd:
-            data = data[:4] + scramble_payload(data[4:], self.scramble_mode_fwd)
-            print("[Router→] CORRUPT payload")
+        done = 0  # o que de fato aconteceu, para o trace
+        if flags & F_CORRUPT:
+            h = tamanho_cabecalho(data)
+            with self.decision_lock:
+                data = data[:h] + scramble_payload(data[h:], self._param(state, 'scramble_mode_fwd'), self.rng)
+            done |= F_CORRUPT
+            self._event('fwd', 'corrupt', n, "[Router→] %sCORRUPT seq=%s", _forced_tag(fflags, F_CORRUPT), seq, state=state)
 
-        maybe(self.delay_mean_fwd)
+        at = self._release_at('fwd', delay, n, state)
+        if at is None:
+            self._event('fwd', 'queue_drop', n, "[Router→] QUEUE DROP seq=%s (gargalo)", seq, state=state)
+            self._trace_decision('fwd', seq, data, done | F_QUEUE_DROP, delay, state.sender_addr)
+            return
 
+        # reordenação dentro do fluxo: cada fluxo tem seu buffer e sua janela
+        buf = state.buffer_reorder
         with self.lock:
-            # Forçar HOLD (reorder) por seq
-            if seq is not None and seq in self.force_reorder_seqs:
-                self.buffer_reorder.append(data)
-                print(f"[Router→] FORCED HOLD seq={seq} para reordenar (buffer={len(self.buffer_reorder)})")
+            if flags & F_HOLD:
+                self._hold(flow, state, data, seq)
+                self._event('fwd', 'hold', n, "[Router→] %sHOLD seq=%s para reordenar (buffer=%d)",
+                            _forced_tag(fflags, F_HOLD), seq, len(buf), state=state)
+                self._trace_decision('fwd', seq, data, done | F_HOLD, delay, state.sender_addr)
                 return
-            if self.reorder_window > 0 and random.random() < self.p_reorder_fwd:
-                self.buffer_reorder.append(data)
-                print("[Router→] HOLD pacote p/ reordenação")
+            if buf and (len(buf) >= self._param(state, 'reorder_window') or flags & F_RELEASE):
+                _, pkt, old_seq = buf.popleft()
+                self.metrics.observe('reorder_occupancy', len(buf), DEPTH_BUCKETS)
+                # sai no mesmo instante, mas antes do pacote atual
+                self._send(at, 'fwd', flow.sock_fwd, pkt, flow.receiver_addr, old_seq, state)
+                done |= F_RELEASE
+                self._event('fwd', 'reorder', len(pkt), "[Router→] REORDER envio de pacote antigo seq=%s", old_seq, state=state)
+
+        self._send(at, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
+        if flags & F_DUP:
+            self._send(at + DUP_SPACING, 'fwd', flow.sock_fwd, data, flow.receiver_addr, seq, state)
+            done |= F_DUP
+            self._event('fwd', 'dup', n, "[Router→] %sDUP seq=%s", _forced_tag(fflags, F_DUP), seq, state=state)
+        self._trace_decision('fwd', seq, data, done, delay, state.sender_addr)
+
+    def _trace_decision(self, direction, seq, data, flags, delay, sender):
+        trace = self.trace
+        if trace is not None:
+            trace.write(direction, KIND_DECISION, flags, seq, data, delay, sender, _flow_conn(direction, data))
+
+    def _event(self, direction, action, nbytes, msg, *args, state=None):
+        """Conta a ação (no total e no fluxo) e registra a mensagem (amostrada: 1 a cada log_sample eventos)."""
+        self.metrics.count(direction, action, nbytes)
+        if state is not None:
+            state.metrics.count(direction, action, nbytes)
+        if log.isEnabledFor(logging.INFO) and next(self.log_counter) % self.log_sample == 0:
+            log.info(msg, *args)
+
+    def _send(self, at, direction, sock, data, addr, seq=None, state=None):
+        self.scheduler.call_at(at, self._transmit, direction, sock, data, addr, seq, KIND_TX, state)
+
+    def _transmit(self, direction, sock, data, addr, seq=None, kind=KIND_TX, state=None):
+        sock.sendto(data, addr)
+        self.metrics.count(direction, 'tx', len(data))
+        if state is not None:
+            state.metrics.count(direction, 'tx', len(data))
+        trace = self.trace
+        if trace is not None:
+            # o emissor do fluxo: destino dos ACKs, origem dos dados
+            sender = addr if direction == 'back' else state.sender_addr if state is not None else None
+            trace.write(direction, kind, 0, seq, data, 0.0, sender, _flow_conn(direction, data))
+
+    def _release_at(self, direction, delay, nbytes, clock):
+        """Instante de saída de um pacote: gargalo (se houver) + atraso, sem ultrapassar o anterior
+        do mesmo fluxo (clock: o FlowState, ou o Flow para ACKs sem entrada na tabela).
+
+        Devolve None quando a fila do gargalo descarta o pacote.
+        """
+        with self.decision_lock:
+            now = time.monotonic()
+            base = now
+            shaper = self.shapers[direction]
+            if shaper is not None:
+                base, qlen = shaper.admit(now, nbytes)
+                self.metrics.observe('queue_depth_' + direction, qlen, DEPTH_BUCKETS)
+                if base is None:
+                    return None
+                self.metrics.observe('sojourn_' + direction, base - now)
+            at = max(base + delay, clock.last_release[direction])
+            clock.last_release[direction] = at
+        self.metrics.observe('delay_' + direction, at - now)
+        return at
+
+    def _hold(self, flow, state, data, seq):
+        # chamado com self.lock; se nenhum pacote posterior do fluxo liberar este, ele expira sozinho
+        hid = next(self.hold_ids)
+        state.buffer_reorder.append((hid, data, seq))
+        self.metrics.observe('reorder_occupancy', len(state.buffer_reorder), DEPTH_BUCKETS)
+        hold_max = self._param(state, 'reorder_hold_max')
+        if hold_max > 0:
+            self.scheduler.call_at(time.monotonic() + hold_max, self._expire_hold, flow, state, hid)
+
+    def _expire_hold(self, flow, state, hid):
+        buf = state.buffer_reorder
+        with self.lock:
+            for i, (h, pkt, seq) in enumerate(buf):
+                if h == hid:
+                    del buf[i]
+                    break
+            else:
                 return
-            if self.buffer_reorder and (len(self.buffer_reorder) >= self.reorder_window or random.random() < 0.5):
-                pkt = self.buffer_reorder.popleft()
-                self.sock_fwd.sendto(pkt, self.receiver_addr)
-                print("[Router→] REORDER envio de pacote antigo")
-
-        self.sock_fwd.sendto(data, self.receiver_addr)
-        # Duplicação forçada por seq
-        if seq is not None and seq in self.force_dup_seqs:
-            time.sleep(0.02)
-            self.sock_fwd.sendto(data, self.receiver_addr)
-            print(f"[Router→] FORCED DUP seq={seq}")
-        elif random.random() < self.p_dup_fwd:
-            time.sleep(0.02)
-            self.sock_fwd.sendto(data, self.receiver_addr)
-            print("[Router→] DUP pacote")
-
-    def thread_backward(self):
-        print(f"[Router] Escutando ACKs do receptor em {self.receiver_addr[1]}")
+            self.metrics.observe('reorder_occupancy', len(buf), DEPTH_BUCKETS)
+        self._transmit('fwd', flow.sock_fwd, pkt, flow.receiver_addr, seq, KIND_EXPIRED, state)
+        self._event('fwd', 'expired', len(pkt), "[Router→] HOLD expirado, pacote retido enviado", state=state)
+
+    def thread_backward(self, flow=None):
+        flow = flow or self.flows[0]
+        log.info("[Router] Escutando ACKs do receptor em %s", flow.sock_back.getsockname()[1])
         while self.running:
-            try: data, _ = self.sock_back.recvfrom(65535)
+            try: data, addr = flow.sock_back.recvfrom(MAX_DATAGRAM)
             except OSError: break
-            if random.random() < self.p_drop_back:
-                print("[Router←] DROP ACK"); continue
-            maybe(self.delay_mean_back)
-            self.sock_back.sendto(data, self.sender_addr)
-            print(f"[Router←] ACK repassado: {data.decode(errors='ignore')}")
-            if random.random() < self.p_dup_back:
-                time.sleep(0.02)
-                self.sock_back.sendto(data, self.sender_addr)
-                print("[Router←] DUP ACK")
+            self.handle_backward(flow, data, addr)
 
-    def run(self):
-        tf = threading.Thread(target=self.thread_forward, daemon=True)
-        tb = threading.Thread(target=self.thread_backward, daemon=True)
-        tf.start(); tb.start()
+    def handle_backward(self, flow, data, addr=None):
+        t0 = time.perf_counter()
+        n = len(data)
+        self.metrics.count('back', 'rx', n)
+        # o ACK volta para o emissor do seu fluxo (pelo id de conexão ecoado, se houver)
+        conn = ack_conn(data)
+        state, dest = flow.table.route_ack(conn)
+        dest = dest or flow.sender_addr
+        if state is not None:
+            state.metrics.count('back', 'rx', n)
+        seq = ack_number(data) if self.trace is not None or self.replay is not None else None
+        with self.decision_lock:
+            rec = self.replay.next('back', seq, conn) if self.replay is not None and seq is not None else None
+            if rec is None:
+                flags = ((F_DROP if self.rand() < self._param(state, 'p_drop_back') else 0) |
+                         (F_DUP if self.rand() < self._param(state, 'p_dup_back') else 0))
+                delay = sample_delay(self._param(state, 'delay_mean_back'), self.rand())
+            else:
+                flags, delay = rec
+        if flags & F_DROP:
+            flags = F_DROP
+            self._event('back', 'drop', n, "[Router←] DROP ACK", state=state)
+        else:
+            at = self._release_at('back', delay, n, state if state is not None else flow)
+            if at is None:
+                flags = F_QUEUE_DROP
+                self._event('back', 'queue_drop', n, "[Router←] QUEUE DROP ACK (gargalo)", state=state)
+            else:
+                self._send(at, 'back', flow.sock_back, data, dest, seq, state)
+                if log.isEnabledFor(logging.INFO) and next(self.log_counter) % self.log_sample == 0:
+                    log.info("[Router←] ACK repassado: %s", descrever_ack(data))
+                if flags & F_DUP:
+                    self._send(at + DUP_SPACING, 'back', flow.sock_back, data, dest, seq, state)
+                    self._event('back', 'dup', n, "[Router←] DUP ACK", state=state)
+        self._trace_decision('back', seq, data, flags, delay, dest)
+        self.metrics.observe('proc_back', time.perf_counter() - t0)
+
+    def report_rate(self, interval, last=None):
+        """Registra pacotes/s por direção a cada `interval` segundos (evento do próprio agendador)."""
+        now = time.monotonic()
+        counts = {d: self.metrics.packets(d, 'rx') for d in ('fwd', 'back')}
+        if last is not None:
+            t0, c0 = last
+            dt = now - t0
+            log.info("[Router] taxa: fwd=%.0f pkt/s back=%.0f pkt/s",
+                     (counts['fwd'] - c0['fwd']) / dt, (counts['back'] - c0['back']) / dt)
+        if self.running:
+            self.scheduler.call_at(now + interval, self.report_rate, interval, (now, counts))
+
+    def report_stats(self, interval):
+        """Registra o snapshot completo de métricas (JSON) a cada `interval` segundos."""
+        log.info("[Router] stats %s", json.dumps(self.metrics.snapshot()))
+        if self.running:
+            self.scheduler.call_at(time.monotonic() + interval, self.report_stats, interval)
+
+    def run(self, engine="threads", batch=1, report_interval=0, stats_interval=0):
+        if report_interval > 0:
+            self.report_rate(report_interval)
+        if stats_interval > 0:
+            self.scheduler.call_at(time.monotonic() + stats_interval, self.report_stats, stats_interval)
         try:
-            while self.running: time.sleep(0.2)
+            if engine == "selectors":
+                self.run_selectors(batch)
+            else:
+                self.run_threads()
         except KeyboardInterrupt:
             pass
         finally:
-            self.stop(); tf.join(1.0); tb.join(1.0)
-            print("[Router] Encerrado.")
+            self.stop()
+            log.info("[Router] Encerrado.")
+
+    def run_threads(self):
+        """Motor original: uma thread bloqueante por socket, mais a thread do agendador."""
+        threads = [threading.Thread(target=self.scheduler.run, daemon=True)]
+        for flow in self.flows:
+            threads.append(threading.Thread(target=self.thread_forward, args=(flow,), daemon=True))
+            threads.append(threading.Thread(target=self.thread_backward, args=(flow,), daemon=True))
+        if self.sock_ctl:
+            threads.append(threading.Thread(target=self.thread_control, daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            while self.running: time.sleep(0.2)
+        finally:
+            self.scheduler.stop()
+            for t in threads:
+                t.join(1.0)
+
+    def run_selectors(self, batch=1):
+        """Motor de laço único: multiplexa todos os sockets e drena o agendador na mesma thread.
+
+        Com batch > 1, cada socket pronto é esvaziado (até `batch` datagramas) com
+        recvfrom_into em buffers pré-alocados; o lote inteiro passa pelas decisões e
+        os envios devidos saem juntos ao final do lote.
+        """
+        sel = selectors.DefaultSelector()
+        for flow in self.flows:
+            for sock, handler in ((flow.sock_fwd, self.handle_forward), (flow.sock_back, self.handle_backward)):
+                sock.setblocking(False)
+                sel.register(sock, selectors.EVENT_READ, (flow, handler))
+            log.info("[Router] Fluxo %s -> %s, ACKs em %s", flow.sock_fwd.getsockname(), flow.receiver_addr, flow.sock_back.getsockname()[1])
+        if self.sock_ctl:
+            self.sock_ctl.setblocking(False)
+            sel.register(self.sock_ctl, selectors.EVENT_READ, None)
+        views = [memoryview(bytearray(MAX_DATAGRAM)) for _ in range(max(1, batch))]
+        try:
+            while self.running:
+                deadline = self.scheduler.next_deadline()
+                timeout = 0.2 if deadline is None else min(0.2, max(0.0, deadline - time.monotonic()))
+                for key, _ in sel.select(timeout):
+                    if key.data is None:
+                        try:
+                            self.serve_control_once()
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                        continue
+                    flow, handler = key.data
+                    try:
+                        for data, addr in recv_batch(key.fileobj, views):
+                            handler(flow, data, addr)
+                    except OSError:
+                        if not self.running:
+                            return
+                self.scheduler.run_due()
+        finally:
+            sel.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Roteador UDP com regras forçadas por seq")
@@ -273,88 +1328,196 @@ if __name__ == "__main__":
     parser.add_argument("--receiver-port", type=int, default=9002)
     parser.add_argument("--p-corrupt", type=float, default=0.05)
     parser.add_argument("--p-drop", type=float, default=0.05)
+    parser.add_argument("--loss-model", choices=["bernoulli", "gilbert", "profile"], default="bernoulli", help="Modelo de perda emissor->receptor (bernoulli usa --p-drop)")
+    parser.add_argument("--ge-p-gb", type=float, default=0.01, help="Gilbert-Elliott: prob. Bom->Ruim por pacote")
+    parser.add_argument("--ge-p-bg", type=float, default=0.3, help="Gilbert-Elliott: prob. Ruim->Bom por pacote")
+    parser.add_argument("--ge-loss-good", type=float, default=0.0, help="Gilbert-Elliott: perda no estado Bom")
+    parser.add_argument("--ge-loss-bad", type=float, default=0.5, help="Gilbert-Elliott: perda no estado Ruim")
+    parser.add_argument("--loss-profile", type=str, default="", help="Arquivo com degraus 't p' (ou JSON [[t,p],...]) para --loss-model profile")
+    parser.add_argument("--loss-profile-loop", action="store_true", help="Repete o perfil ao chegar ao ultimo degrau")
+    parser.add_argument("--trace", type=str, default="", help="Grava um trace binario das decisoes e envios (ver packet_trace.py)")
+    parser.add_argument("--replay", type=str, default="", help="Reaplica as decisoes de um trace gravado com --trace")
+    parser.add_argument("--seed", type=int, default=None, help="Semente das decisoes aleatorias (execucoes reprodutiveis)")
     parser.add_argument("--p-dup", type=float, default=0.05)
     parser.add_argument("--p-reorder", type=float, default=0.2)
     parser.add_argument("--reorder-window", type=int, default=3)
     parser.add_argument("--delay-mean", type=float, default=0.02)
-    parser.add_argument("--scramble-mode", choices=["shuffle", "xor", "bitflip"], default="bitflip")
+    parser.add_argument("--reorder-hold-max", type=float, default=1.0, help="Tempo maximo (s) que um pacote fica retido para reordenacao; 0 = sem limite")
+    parser.add_argument("--scramble-mode", choices=SCRAMBLE_MODES, default="bitflip")
     parser.add_argument("--p-drop-ack", type=float, default=0.02)
     parser.add_argument("--p-dup-ack", type=float, default=0.03)
     parser.add_argument("--delay-mean-ack", type=float, default=0.01)
-    parser.add_argument("--force-drop", type=str, default="", help="Seq numbers/ranges to FORCE drop, e.g. '2,5-7'")
+    parser.add_argument("--rate", type=float, default=0, help="Capacidade do enlace emissor->receptor em bytes/s (0 = ilimitada)")
+    parser.add_argument("--burst", type=int, default=0, help="Rajada do token bucket em bytes (0 = 1500)")
+    parser.add_argument("--queue-limit", type=int, default=0, help="Tamanho da fila do gargalo em pacotes (0 = ilimitada)")
+    parser.add_argument("--aqm", choices=["taildrop", "red", "codel"], default="taildrop")
+    parser.add_argument("--rate-ack", type=float, default=0, help="Capacidade do caminho de ACKs em bytes/s (0 = ilimitada)")
+    parser.add_argument("--burst-ack", type=int, default=0)
+    parser.add_argument("--queue-limit-ack", type=int, default=0)
+    parser.add_argument("--aqm-ack", choices=["taildrop", "red", "codel"], default="taildrop")
+    parser.add_argument("--codel-target", type=float, default=0.005, help="CoDel: permanencia alvo na fila (s)")
+    parser.add_argument("--codel-interval", type=float, default=0.1, help="CoDel: intervalo de observacao (s)")
+    parser.add_argument("--force-drop", type=str, default="", help="Seq numbers/ranges to FORCE drop, e.g. '2,5-7,65530-3,%%10+1'")
     parser.add_argument("--force-corrupt", type=str, default="", help="Seq numbers/ranges to FORCE corrupt")
     parser.add_argument("--force-dup", type=str, default="", help="Seq numbers/ranges to FORCE duplicate")
     parser.add_argument("--force-reorder", type=str, default="", help="Seq numbers/ranges to FORCE reorder (hold)")
+    parser.add_argument("--seq-modulus", type=int, default=SEQ_MODULUS, help="Espaco de seqs para regras forcadas (faixas 'a-b' com a>b dao a volta); 0 = seqs absolutos do emissor, sem reducao")
     parser.add_argument("--interactive-control", action="store_true", help="Start interactive control prompt to add/remove forced errors at runtime")
     parser.add_argument("--interactive", action="store_true", help="Modo interativo: escolha acao para cada pacote")
+    parser.add_argument("--control-port", type=int, default=0, help="Porta UDP local para comandos de controle (texto ou JSON); 0 = desligado")
+    parser.add_argument("--engine", choices=["threads", "selectors"], default="threads", help="threads: uma thread por socket; selectors: um unico laco de eventos para todos os fluxos")
+    parser.add_argument("--batch", type=int, default=1, help="(engine selectors) maximo de datagramas lidos por socket a cada despertar")
+    parser.add_argument("--report-interval", type=float, default=0, help="Imprime pacotes/s por direcao a cada N segundos (0 = desligado)")
+    parser.add_argument("--stats-interval", type=float, default=0, help="Registra o snapshot de metricas (JSON) a cada N segundos (0 = desligado)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Nivel de log; WARNING silencia os eventos por pacote")
+    parser.add_argument("--log-sample", type=int, default=1, help="Registra 1 a cada N eventos por pacote")
+    parser.add_argument("--flow", action="append", default=[], metavar="RPORT:RECVPORT:ACKPORT:SENDPORT", help="Fluxo extra (repetivel): porta do roteador, do receptor, de ACKs e do emissor")
+    parser.add_argument("--ack-port", type=int, default=9003, help="Porta onde o receptor entrega os ACKs")
+    parser.add_argument("--flow-key", choices=["conn", "addr"], default="conn", help="Tabela de fluxos: origem + id de conexao do cabecalho (conn) ou so a origem (addr)")
+    parser.add_argument("--flow-profile", action="append", default=[], metavar="'MATCH PARAM=VALOR ...'", help="Perfil de impairment por fluxo (repetivel); MATCH: *, conn:N, host:porta ou host:porta#N; PARAM: os de 'get' (p_drop_fwd, delay_mean_fwd, ...)")
+    parser.add_argument("--workers", type=int, default=1, help="Processos nas mesmas portas com SO_REUSEPORT: o kernel reparte os fluxos pelo endereco de origem")
 
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(message)s")
 
-    forced_drop = parse_seq_list(args.force_drop)
-    forced_corrupt = parse_seq_list(args.force_corrupt)
-    forced_dup = parse_seq_list(args.force_dup)
-    forced_reorder = parse_seq_list(args.force_reorder)
-
-    router = UDPRouter(
-        args.router_host, args.router_port,
-        args.sender_host, args.sender_port,
-        args.receiver_host, args.receiver_port,
-        p_corrupt_fwd=args.p_corrupt, p_drop_fwd=args.p_drop, p_dup_fwd=args.p_dup,
-        p_reorder_fwd=args.p_reorder, delay_mean_fwd=args.delay_mean, scramble_mode_fwd=args.scramble_mode,
-        p_drop_back=args.p_drop_ack, p_dup_back=args.p_dup_ack, delay_mean_back=args.delay_mean_ack,
-        reorder_window=args.reorder_window,
-        force_drop_seqs=forced_drop, force_corrupt_seqs=forced_corrupt, force_dup_seqs=forced_dup, force_reorder_seqs=forced_reorder
-    )
-    
-    # Ativa modo interativo se solicitado
-    if args.interactive:
-        router.interactive_mode = True
-        print("\n" + "="*60)
-        print("MODO INTERATIVO ATIVADO!")
-        print("="*60)
-        print("Voce podera escolher o que fazer com cada pacote recebido.")
-        print("Opcoes: enviar, perder, corromper, duplicar ou segurar")
-        print("="*60 + "\n")
-
-    # controle interativo em tempo de execução (opcional)
-    if getattr(args, 'interactive_control', False):
-        def control_loop(rtr: UDPRouter):
-            print("Controle interativo: use 'add <type> <list>', 'remove <type> <list>', 'clear [type]', 'show', 'exit'")
-            while True:
-                try:
-                    cmd = input('control> ').strip()
-                except (EOFError, KeyboardInterrupt):
-                    print('\nSaindo do controle interativo.')
-                    break
-                if not cmd:
-                    continue
-                parts = cmd.split(None, 2)
-                action = parts[0].lower()
-                if action == 'exit':
-                    break
-                if action == 'show':
-                    rtr.show_forced(); continue
-                if action in ('clear',):
-                    if len(parts) == 1:
-                        rtr.clear_forced(); print('All forced rules cleared');
-                    else:
-                        rtr.clear_forced(parts[1]); print(f'Cleared {parts[1]}')
-                    continue
-                if action in ('add', 'remove', 'set'):
-                    if len(parts) < 3:
-                        print('Usage: add|remove|set <type> <list>'); continue
-                    typ = parts[1]
-                    seqs = parse_seq_list(parts[2])
-                    if action == 'add':
-                        rtr.add_forced(typ, seqs); print(f'Added {sorted(seqs)} to {typ}')
-                    elif action == 'remove':
-                        rtr.remove_forced(typ, seqs); print(f'Removed {sorted(seqs)} from {typ}')
-                    elif action == 'set':
-                        rtr.clear_forced(typ); rtr.add_forced(typ, seqs); print(f'Set {typ} to {sorted(seqs)}')
-                    continue
-                print('Comando desconhecido')
-
-        t_ctl = threading.Thread(target=control_loop, args=(router,), daemon=True)
-        t_ctl.start()
-
-    router.run()
+    modulus = args.seq_modulus or None
+    forced_drop = parse_seq_list(args.force_drop, modulus)
+    forced_corrupt = parse_seq_list(args.force_corrupt, modulus)
+    forced_dup = parse_seq_list(args.force_dup, modulus)
+    forced_reorder = parse_seq_list(args.force_reorder, modulus)
+
+    # validação antes de criar os workers
+    flow_specs = []
+    for spec in args.flow:
+        try:
+            flow_specs.append(tuple(int(x) for x in spec.split(':')))
+        except ValueError:
+            parser.error(f"--flow invalido: {spec!r}")
+        if len(flow_specs[-1]) != 4:
+            parser.error(f"--flow invalido: {spec!r}")
+    for spec in args.flow_profile:
+        try:
+            FlowProfiles(UDPRouter.TUNABLE).parse(spec)
+        except ValueError as e:
+            parser.error(f"--flow-profile invalido: {e}")
+    if args.loss_model == "profile" and not args.loss_profile:
+        parser.error("--loss-model profile requer --loss-profile")
+    if args.batch > 1 and args.engine != "selectors":
+        parser.error("--batch requer --engine selectors")
+    if args.workers < 1:
+        parser.error("--workers deve ser >= 1")
+    for suffix, rate, limit, aqm in (("", args.rate, args.queue_limit, args.aqm),
+                                     ("-ack", args.rate_ack, args.queue_limit_ack, args.aqm_ack)):
+        # sem --rate não há fila: limite e AQM seriam ignorados em silêncio
+        if rate <= 0 and (limit > 0 or aqm != "taildrop"):
+            parser.error(f"--queue-limit{suffix}/--aqm{suffix} atuam na fila do gargalo: requerem --rate{suffix}")
+        if aqm == "red" and limit <= 0:
+            parser.error(f"--aqm{suffix} red requer --queue-limit{suffix} (limiares em 25% e 75% da fila)")
+    if args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            parser.error("--workers requer SO_REUSEPORT (Linux/BSD)")
+        if args.interactive or args.interactive_control:
+            parser.error("os modos interativos leem do console: use --workers 1")
+
+    def run_worker(worker=0, directories=None):
+        """Monta e roda um roteador; com --workers, um por processo, nas mesmas portas."""
+        sharded = args.workers > 1
+        if sharded:
+            for handler in logging.getLogger().handlers:
+                handler.setFormatter(logging.Formatter(f"[w{worker}] %(message)s"))
+        router = UDPRouter(
+            args.router_host, args.router_port,
+            args.sender_host, args.sender_port,
+            args.receiver_host, args.receiver_port,
+            p_corrupt_fwd=args.p_corrupt, p_drop_fwd=args.p_drop, p_dup_fwd=args.p_dup,
+            p_reorder_fwd=args.p_reorder, delay_mean_fwd=args.delay_mean, scramble_mode_fwd=args.scramble_mode,
+            p_drop_back=args.p_drop_ack, p_dup_back=args.p_dup_ack, delay_mean_back=args.delay_mean_ack,
+            reorder_window=args.reorder_window, reorder_hold_max=args.reorder_hold_max, seq_modulus=modulus, log_sample=args.log_sample,
+            seed=None if args.seed is None else args.seed + worker,
+            force_drop_seqs=forced_drop, force_corrupt_seqs=forced_corrupt, force_dup_seqs=forced_dup, force_reorder_seqs=forced_reorder,
+            ack_port=args.ack_port, flow_key=args.flow_key, reuse_port=sharded,
+            directory=directories[0] if directories else None
+        )
+
+        # com workers, cada processo grava/relê o seu trace (arquivo.N)
+        suffix = f".{worker}" if sharded else ""
+        if args.replay:
+            router.load_replay(args.replay + suffix)
+        if args.trace:
+            router.open_trace(args.trace + suffix)
+
+        if args.loss_model == "gilbert":
+            router.set_loss_model(GilbertElliottLoss(args.ge_p_gb, args.ge_p_bg, args.ge_loss_good, args.ge_loss_bad, router.stream))
+        elif args.loss_model == "profile":
+            router.set_loss_model(ProfileLoss(load_profile(args.loss_profile), router.stream, loop=args.loss_profile_loop))
+
+        for direction, rate, burst, limit, aqm in (('fwd', args.rate, args.burst, args.queue_limit, args.aqm),
+                                                   ('back', args.rate_ack, args.burst_ack, args.queue_limit_ack, args.aqm_ack)):
+            if rate > 0:
+                router.set_shaper(direction, LinkShaper(rate, burst, limit, aqm,
+                                                        codel_target=args.codel_target, codel_interval=args.codel_interval))
+
+        for spec in args.flow_profile:
+            router.add_profile(spec)
+
+        for i, (r_port, recv_port, ack_port, send_port) in enumerate(flow_specs):
+            router.add_flow(r_port, (args.receiver_host, recv_port), ack_port, (args.sender_host, send_port),
+                            directories[i + 1] if directories else None)
+
+        # Ativa modo interativo se solicitado
+        if args.interactive:
+            router.interactive_mode = True
+            print("\n" + "="*60)
+            print("MODO INTERATIVO ATIVADO!")
+            print("="*60)
+            print("Voce podera escolher o que fazer com cada pacote recebido.")
+            print("Opcoes: enviar, perder, corromper, duplicar ou segurar")
+            print("="*60 + "\n")
+
+            threading.Thread(target=router.interactive_loop, daemon=True).start()
+
+        if args.control_port:
+            router.open_control(args.control_port + worker)  # um endpoint por worker
+
+        # controle interativo em tempo de execução (opcional)
+        if getattr(args, 'interactive_control', False):
+            def control_loop(rtr: UDPRouter):
+                print("Controle interativo: " + rtr.CONTROL_HELP + " | exit")
+                while True:
+                    try:
+                        cmd = input('control> ').strip()
+                    except (EOFError, KeyboardInterrupt):
+                        print('\nSaindo do controle interativo.')
+                        break
+                    if not cmd:
+                        continue
+                    if cmd.lower() == 'exit':
+                        break
+                    print(rtr.execute_command(cmd))
+
+            t_ctl = threading.Thread(target=control_loop, args=(router,), daemon=True)
+            t_ctl.start()
+
+        # SIGTERM (kill, ou repassado pelo processo pai) encerra como o Ctrl+C: fecha o trace
+        signal.signal(signal.SIGTERM, lambda *_: router.stop())
+        router.run(args.engine, batch=args.batch, report_interval=args.report_interval, stats_interval=args.stats_interval)
+
+    if args.workers == 1:
+        run_worker()
+    else:
+        # Cada worker abre as mesmas portas com SO_REUSEPORT; o kernel escolhe o worker pelo hash
+        # da origem, então todos os pacotes de um emissor caem no mesmo processo (e no mesmo
+        # FlowState). Só a tabela id de conexão -> emissor, usada para rotear ACKs, é compartilhada.
+        directories = [ConnDirectory.shared() for _ in range(1 + len(flow_specs))]
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=run_worker, args=(i, directories), name=f"roteador-{i}") for i in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        signal.signal(signal.SIGTERM, lambda *_: [proc.terminate() for proc in procs])
+        log.info("[Router] %d workers em %s:%s (SO_REUSEPORT)", args.workers, args.router_host, args.router_port)
+        try:
+            for proc in procs:
+                proc.join()
+        except KeyboardInterrupt:
+            for proc in procs:  # o Ctrl+C chega a todo o grupo: cada worker encerra sozinho
+                proc.join()